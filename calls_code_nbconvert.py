@@ -62,50 +62,42 @@ call_data_test = call_data.iloc[2000000:2000100,:]
 # In[4]:
 
 
-external_call_types_list = ["TELEPHONE OTHER, not 911", "911", "ALARM CALL (NOT POLICE ALARM)", "POLICE (VARDA ALARM)", "IN PERSON COMPLAINT", "TEXT MESSAGE"]
-internal_call_types_list = ["ONVIEW", "PROACTIVE (OFFICER INITIATED)", "SCHEDULED EVENT (RECURRING)"]
-def callSource(x):
-    if x in internal_call_types_list:
-        return "Internal"
-    elif x in external_call_types_list:
-        return "External"
-    else:
-        return "Other"
-
-call_data_modified = call_data
-# Appending the "Call Source" column to the dataframe based on the entries in "Call Type"
-call_data_modified["Call Source"] = [callSource(entry) for entry in call_data.iloc[:,2]]
-# Saving my work because the previous iteration-based attempt took half of forever
-call_data_modified.to_csv('911 reports modified.txt', index=False, sep='\t')
+# The call type lists and the classification live in call_classify so the incremental ingest classifies new calls the same way
+from event_impact.call_classify import external_call_types_list, internal_call_types_list, text_columns, normalizeCategories, callSources, crimeGroups
+
+# Cleaning up whitespace, case and leading punctuation in the text columns; each distinct value is handled once
+for column in text_columns:
+    call_data[column] = normalizeCategories(call_data[column])
+# Appending the "Call Source" column to the dataframe based on the entries in "Call Type", looking up each call type once
+call_data["Call Source"] = callSources(call_data["Call Type"])
 
 
 # There are too many final and initial call types (418 and 315, respectively) for the approach of binning crimes by type, as done with the police reports, to be a good investment of energy, at least without some evidence that this exercise will actually be useful.
 # 
 # Initial attempt to apply the previously-developed code from SPD-reports before-after shows that "Original Time Queued" is stored in the dataframe as a string. Thankfully, the format seems to be consistent?
 # MM/DD/YYYY HH:MM:SS AP
-# %m/%d/%Y  %l:%M:%S %p
+# %m/%d/%Y %I:%M:%S %p
 
 # In[5]:
 
 
-import datetime
-
-# Modified from JournalDev python string to datatime - strptime()
-def timeConversion(x):
-    try:
-        # Converting string of set format to date only
-        return datetime.datetime.strptime(x, '%m/%d/%Y %H:%M:%S %p').date()
-    except ValueError as ve:
-        try:
-            # Converting with a slower function that can deal with variations in format to a certain extent
-            pd.to_datetime(x, dayfirst = False, yearfirst = False, infer_datetime_format = True)
-        except ValueError as ve:
-            print('ValueError Raised:', ve)
+# Each distinct timestamp string is parsed once, in bulk; only the ones that don't fit the format above go
+# through the slower flexible parser. Keeping the full timestamp, plus the date on its own for windowing.
+from event_impact.call_times import parseTimestamps
 
+parsed_times = parseTimestamps(call_data["Original Time Queued"])
+if parsed_times.failed_count:
+    print(str(parsed_times.failed_count) + ' entries in "Original Time Queued" could not be parsed, e.g.:')
+    print(parsed_times.failed_sample)
+call_data["Original Time Queued"] = parsed_times.timestamps
+call_data["Date Queued"] = parsed_times.timestamps.dt.normalize()
 
-    
-# Using timeConversion(x) to update all the entries for "Original Time Queued" in call_data
-call_data.iloc[:,6] = call_data.iloc[:,6].map(timeConversion)
+# Saving my work because the previous iteration-based attempt took half of forever. The tab-separated dump
+# had to be re-parsed on every load, so instead the cleaned data goes into a typed store partitioned by month.
+# (Outside the notebook, `event-impact ingest Call_Data.csv` streams the export into the store in chunks sized
+# to a memory budget, without ever holding the whole file; see call_store.ingestExport.)
+from event_impact.call_store import ingestCalls, sharedCalls
+ingestCalls(call_data, 'call_store')
 
 
 # ## Changes in beats
@@ -123,10 +115,10 @@ call_data.iloc[:,6] = call_data.iloc[:,6].map(timeConversion)
 window = 90
 event_date = datetime.date(2015, 4, 5)
 event_location = "B2"
-beat_changes = [datetime.date(2008, 1, 1), datetime.date(2015, 1, 1), datetime.date(2018, 1, 1)]
+from event_impact.beat_assets import beat_changes
 for entry in beat_changes:
     if abs(event_date - entry) < datetime.timedelta(days = window):
-        print("CAUTION: Beats have changed during the window used; proceed with caution or compare by sector/precinct")
+        print("CAUTION: Beats have changed during the window used; beat counts below are re-projected onto the 2018-present beats")
 if event_date - datetime.timedelta(days = 90) < datetime.date(2009, 6, 2):
     print("First entry in call_data is 6 June 2009; adjust window or choose another event date.")
 
@@ -138,7 +130,10 @@ if event_date - datetime.timedelta(days = 90) < datetime.date(2009, 6, 2):
 
 start = event_date - datetime.timedelta(days = window)
 end = event_date + datetime.timedelta(days = window)
-within_window = call_data.loc[(call_data["Original Time Queued"] > start) & (call_data["Original Time Queued"] < end), ["CAD Event Number", "Call Source", "Original Time Queued", "Precinct", "Sector", "Beat"]].copy()
+# Only the months around event_date (and only the columns used below) are read from the store, and re-running
+# the cell for the same window reuses the calls already read
+within_window = sharedCalls('call_store', columns = ["CAD Event Number", "Call Source", "Original Time Queued", "Date Queued", "Precinct", "Sector", "Beat"], start = start, end = end)
+within_window = within_window.loc[(within_window["Date Queued"] > pd.Timestamp(start)) & (within_window["Date Queued"] < pd.Timestamp(end))].copy()
 within_window
 
 
@@ -153,35 +148,54 @@ within_window
 # In[28]:
 
 
-precinct = ["EAST", "NORTH", "SOUTH", "SOUTHWEST", "WEST", "UNKNOWN"]
-sector = ["B", "C", "D", "E", "F", "G", "J", "K", "L", "M", "N", "O", "Q", "R", "S", "U", "W"]
-beat = ["B1", "B2", "B3", "C1", "C2", "C3", "D1", "D2", "D3", "E1", "E2", "E3", "F1", "F2", "F3", "G1", "G2", "G3", "J1", "J2", "J3", "K1", "K2", "K3", "L1", "L2", "L3", "M1", "M2", "M3", "N1", "N2", "N3", "O1", "O2", "O3", "Q1", "Q2", "Q3", "R1", "R2", "R3", "S1", "S2", "S3", "U1", "U2", "U3", "W1", "W2", "W3"]
+# The precinct, sector and beat lists live in locations; the counting is in call_rates
+from event_impact.locations import precinct, sector, beat
+from event_impact.call_rates import countBeforeAfter, percentChange
 
-#Using sum to get count of entries that fit given parameters by location (geo_flag)
+# Count of entries before and after event_date for every location in geo_flag and every call source, from a
+# single pass over within_window (the column to group by follows from which list geo_flag is)
 #geo_flag manually set to beat here, but future plan is to allow user to choose at onset, with beat being default
 geo_flag = beat
-all_before = [sum((within_window["Original Time Queued"] < event_date) & (within_window["Beat"] == entry)) for entry in geo_flag]
-all_after = [sum((within_window["Original Time Queued"] >= event_date) & (within_window["Beat"] == entry)) for entry in geo_flag]
-total = [(after-before)/(max(before, 1))*100 for before, after in zip(all_before, all_after)]
+window_counts = countBeforeAfter(within_window, event_date, geo_flag)
+window_counts
 
-int_before = [sum((within_window["Original Time Queued"] < event_date) & (within_window["Beat"] == entry) & (within_window["Call Source"] == "Internal")) for entry in geo_flag]
-int_after = [sum((within_window["Original Time Queued"] >= event_date) & (within_window["Beat"] == entry) & (within_window["Call Source"] == "Internal")) for entry in geo_flag]
-internal = [(after-before)/(max(before, 1))*100 for before, after in zip(int_before, int_after)]
 
-ext_before = [sum((within_window["Original Time Queued"] < event_date) & (within_window["Beat"] == entry) & (within_window["Call Source"] == "External")) for entry in geo_flag]
-ext_after = [sum((within_window["Original Time Queued"] >= event_date) & (within_window["Beat"] == entry) & (within_window["Call Source"] == "External")) for entry in geo_flag]
-external = [(after-before)/(max(before, 1))*100 for before, after in zip(ext_before, ext_after)]
+# In[29]:
 
-oth_before = [sum((within_window["Original Time Queued"] < event_date) & (within_window["Beat"] == entry) & (within_window["Call Source"] == "Other")) for entry in geo_flag]
-oth_after = [sum((within_window["Original Time Queued"] >= event_date) & (within_window["Beat"] == entry) & (within_window["Call Source"] == "Other")) for entry in geo_flag]
-other = [(after-before)/(max(before, 1))*100 for before, after in zip(oth_before, oth_after)]
 
+# Turning the counts into a single dataframe of percentage changes
+percentages = percentChange(window_counts)
+percentages
 
-# In[29]:
+
+# Rather than filtering call_data for every new event, the daily counts can be built once into a cube (saved to
+# disk, memory-mapped on load) and any event_date / window / geo_flag answered with a few array lookups.
+
+# In[30]:
+
+
+from event_impact.call_cube import buildCube, saveCube, loadCube, windowCounts
+
+saveCube(buildCube(sharedCalls('call_store', columns = ["Date Queued", "Call Source", "Precinct", "Sector", "Beat"])), 'call_cube')
+call_cube = loadCube('call_cube')
+percentChange(windowCounts(call_cube, event_date, window, geo_flag))
 
 
-# Combining the lists of percentages into a single dataframe
-percentages = pd.DataFrame({"beat": beat, "total": total, "internal": internal, "external": external, "other": other})
+# When the window straddles one of the beat_changes, the beats on either side aren't the same areas. Each stretch of
+# the window is counted on the beats in force at the time and re-projected onto the 2018-present beats by area
+# (the crosswalk matrices are built from the shapefiles once and cached).
+
+# In[31]:
+
+
+from event_impact.beat_assets import buildAssets
+from event_impact.beat_crosswalk import crosswalkWindowCounts
+
+# The crosswalk works off the prebuilt beat geometry (see the maps further down); only needs doing once
+buildAssets()
+reprojected = geo_flag == beat and any(abs(event_date - entry) < datetime.timedelta(days = window) for entry in beat_changes)
+if reprojected:
+    percentages = percentChange(crosswalkWindowCounts(call_cube, event_date, window))
 percentages
 
 
@@ -227,6 +241,24 @@ else:
     print('The event may have significantly ' + direction + ' calls to the police.')
 
 
+# The z-score only compares the beat against the other beats on one date. Placebo event dates, placebo beats and
+# bootstrapped intervals give p-values and confidence intervals for every call source (about a second, off the cube).
+# They are computed from the cube's own beats, so they are skipped when the percentages above were re-projected
+# across a beat change - the two would disagree about the change for the same event. Compare by sector or
+# precinct instead.
+
+# In[280]:
+
+
+from event_impact.call_stats import eventSignificance
+
+if reprojected:
+    print("Skipping significance: beats changed during the window; re-run with geo_flag = sector or precinct")
+else:
+    significance = eventSignificance(call_cube, event_date, event_location, window, geo_flag)
+    print(significance.table.to_string())
+
+
 # What about visualization by location? After all, I'm always seeing shaded maps in /r/dataisbeautiful, so let's see how difficult it is to set that up. (Spoiler: a choropleth is pretty straightforward once you figure out how, but if you're working with map areas that aren't labeled on the map tiles, it's a bit trickier.)
 # 
 # Let's start by using geopandas. A necessary future improvement will be to have the program automatically pull the appropriate beat, but first I need to get to the basic visualization.
@@ -236,59 +268,20 @@ else:
 # In[222]:
 
 
-# Initializing geodataframe using shapefile
-spd_beats_temp = gpd.read_file('Seattle_Police_Beats_2018-present.shp')
-# Getting geodataframe into the same order as beat
-spd_beats_temp.sort_values(by = "beat", inplace = True)
-# Slicing out the "no beat" line
-spd_beats = spd_beats_temp.iloc[1:, :]
-spd_beats.to_file("beats2018-present.geojson", driver = "GeoJSON")
-
-
-# The beat maps are static, not dynamic, so there's no need to keep repeating the pull-edit-create process over and over. Instead, let's export the geodataframe to a file with a clear name, and do this for all four beat maps. Then, when this project is turned into a proper program, it can pull the beat map as appropriate.
-# Repeating whole process for pre-2008 beats map
-spd_beats_pre_08 = gpd.read_file('Seattle_Police_Beats_Pre-2008.shp')
-spd_beats_pre_08.sort_values(by = "beat", inplace = True)
-spd_beats_pre_08 = spd_beats_pre_08.iloc[1:, :]
-spd_beats_pre_08.to_file("beatsPre2008.geojson", driver = "GeoJSON")
-
-# Repeating whole process for 2008-2015 beats map
-spd_beats_08_15 = gpd.read_file('Seattle_Police_Beats_2008-2015.shp')
-spd_beats_08_15.sort_values(by = "beat", inplace = True)
-spd_beats_08_15 = spd_beats_08_15.iloc[1:, :]
-spd_beats_08_15.to_file("beats2008-2015.geojson", driver = "GeoJSON")
-
-# Repeating whole process for 2015-2017 beats map
-spd_beats_15_17 = gpd.read_file('Seattle_Police_Beats_2015-2017.shp')
-spd_beats_15_17.sort_values(by = "beat", inplace = True)
-spd_beats_15_17 = spd_beats_15_17.iloc[1:, :]
-spd_beats_15_17.to_file("beats2015-2017.geojson", driver = "GeoJSON")# Getting representative point (approx center) per https://stackoverflow.com/a/38902492/2880512
-spd_beats['label_point'] = spd_beats['geometry'].apply(lambda x: x.representative_point().coords)
-# Converting shapely point object into single entries
-spd_beats['label_lat'] = [point[0][1] for point in spd_beats['label_point']]
-spd_beats['label_lon'] = [point[0][0] for point in spd_beats['label_point']]
-# Dropping label_point so dataframe can be exported.
-spd_beats.drop(columns = 'label_point', inplace = True)
+# The beat maps are static, not dynamic, so there's no need to keep repeating the pull-edit-create process over and
+# over. buildAssets (run above) reads all four shapefiles once, sorts them into the same order as beat, slices out
+# the "no beat" line, adds the representative point (approx center) of each beat as label_lat/label_lon, and saves
+# the result (plus simplified copies for zoomed-out maps) as GeoParquet. Only needs re-running if the shapefiles change.
+from event_impact.beat_assets import loadBeats
+
+# Loaded lazily per era and kept for the rest of the session
+spd_beats = loadBeats("2018-present")
+spd_beats_pre_08 = loadBeats("Pre-2008")
+spd_beats_08_15 = loadBeats("2008-2015")
+spd_beats_15_17 = loadBeats("2015-2017")
 # Manually dropping a marker onto the map to confirm that representative_point worked reasonably
 #folium.Marker((47.661, -122.360),
-#              folium.Tooltip(spd_beats.iloc[1, 2],)).add_to(mapviz)# Repeating process including saving to GeoJSON so that this part doesn't need to be wrapped into the function
-spd_beats_pre_08['label_point'] = spd_beats_pre_08['geometry'].apply(lambda x: x.representative_point().coords)
-spd_beats_pre_08['label_lat'] = [point[0][1] for point in spd_beats_pre_08['label_point']]
-spd_beats_pre_08['label_lon'] = [point[0][0] for point in spd_beats_pre_08['label_point']]
-spd_beats_pre_08.drop(columns = 'label_point', inplace = True)
-spd_beats_pre_08.to_file("beatsPre2008.geojson", driver = "GeoJSON")
-
-spd_beats_08_15['label_point'] = spd_beats_08_15['geometry'].apply(lambda x: x.representative_point().coords)
-spd_beats_08_15['label_lat'] = [point[0][1] for point in spd_beats_08_15['label_point']]
-spd_beats_08_15['label_lon'] = [point[0][0] for point in spd_beats_08_15['label_point']]
-spd_beats_08_15.drop(columns = 'label_point', inplace = True)
-spd_beats_08_15.to_file("beats2008-2015.geojson", driver = "GeoJSON")
-
-spd_beats_15_17['label_point'] = spd_beats_15_17['geometry'].apply(lambda x: x.representative_point().coords)
-spd_beats_15_17['label_lat'] = [point[0][1] for point in spd_beats_15_17['label_point']]
-spd_beats_15_17['label_lon'] = [point[0][0] for point in spd_beats_15_17['label_point']]
-spd_beats_15_17.drop(columns = 'label_point', inplace = True)
-spd_beats_15_17.to_file("beats2015-2017.geojson", driver = "GeoJSON")
+#              folium.Tooltip(spd_beats.iloc[1, 2],)).add_to(mapviz)
 
 # In[191]:
 
@@ -352,10 +345,33 @@ for x in range(0, len(spd_beats)):
 mapviz
 
 
+# For a review meeting there are many maps to make rather than one. renderMaps writes the beat geometry once per
+# folder and has every map reference it, labels each beat from one tooltip layer at its label point instead of a
+# marker per beat, and spreads the rendering over worker processes.
+
+# In[194]:
+
+
+from event_impact.call_maps import eventMapJobs, renderMaps
+
+review_events = pd.DataFrame({"event_date": [event_date], "window": [window], "event_location": [event_location]})
+renderMaps(eventMapJobs(call_cube, review_events, ("external", "internal", "total")), 'maps')
+
+
 # It appears that calls originating outside SPD may be less variable than internal calls; if this were a tool I was building purely for fun, rather than as a thing to talk about at the interview, this is the point where I'd work on turning it into a function so that I could run a bunch of random dates to determine
 # 1. When plotting standard deviation of data against window size, is there an inflection point in the slope? This would help inform minimum window size.
 # 2. Is the "External" subset consistently show smaller variance than the "Internal" subset? If so, this strengthens the case for consistently using "External", at least once non-issue calls are stripped from the dataframe.
-# 
+
+# In[282]:
+
+
+# Both questions from a random sweep over the count cube (event_batch.py does the same from the command line)
+from event_impact.event_batch import randomQueries, runQueries, spreadByWindow
+
+sweep = runQueries(randomQueries(call_cube, 10000, [30, 60, 90, 180, 365]), call_cube)
+spreadByWindow(sweep)
+
+
 # However, I want the proto-dashboard I show people to be as interesting as possible, and one of the major underlying hypotheses of this project is that certain events may affect "crime" (as measured by requests for SPD assistance), but probably only specific types of crime.
 # I would expect a homeless encampment moving in to result in a spike in calls for suspicious persons, drugs, and drunk & disorderly. It might also result in an increase in property crime. I would not expect it to affect traffic calls, and I hope it won't affect violent crime - that's probably the biggest and most important question I'm trying to answer here.
 # Similarly, I would expect long-term construction that closes roads to affect traffic reports but little else.
@@ -373,3 +389,22 @@ type(call_ECD_entries)
 
 
 # Something hinky is going on here. Not sure why, but sorting isn't happening correctly. Was going to need to strip leading whitespace and majority of punctuation anyway, so let's get to that.
+# (The cleanup now happens up front with normalizeCategories, so the categories are already stripped and sorted.)
+
+# In[284]:
+
+
+call_ECD_entries = pd.Series(call_data['Event Clearance Description'].cat.categories)
+call_ECD_entries
+
+
+# And the same treatment for the 418 final and 315 initial call types: each one lands in a crime type group (its own
+# heading by default), and editing call_classify.crime_type_groups - or a CSV from groupTable, read back with
+# loadGroups - regroups the whole dataset without re-reading it.
+
+# In[285]:
+
+
+call_data["Final Crime Group"] = crimeGroups(call_data["Final Call Type"])
+call_data["Initial Crime Group"] = crimeGroups(call_data["Initial Call Type"])
+call_data["Final Crime Group"].value_counts()
@@ -0,0 +1,6 @@
+# Before/after impact of events on Seattle Police Department 911 calls.
+#
+# Nothing is imported here, so `import event_impact` (and the event-impact command line) stays cheap; import
+# the module you need, e.g. event_impact.call_cube or event_impact.call_maps.
+
+__version__ = '0.1.0'
@@ -0,0 +1,82 @@
+# Prebuilt beat geometry for every beat era.
+#
+# Each beat map used to go through gpd.read_file, sort, slice, representative_point in a Python apply and
+# to_file, copy-pasted four times with the GeoJSON written twice per era. buildAssets does that once for all
+# the eras: the cleaned geometries with their label lat/lon (vectorized representative points), plus
+# simplified versions at a few tolerances for different map zoom levels, all written as GeoParquet.
+# loadBeats reads one era at one resolution on first use and keeps it for the rest of the process, so map
+# generation never reparses a shapefile and only ships as much geometry as the zoom level needs.
+
+import datetime
+import functools
+import os
+
+from .locations import asset_path
+
+# Era name -> (shapefile, first day of the era, first day of the next era)
+beat_eras = {"Pre-2008": ('Seattle_Police_Beats_Pre-2008.shp', None, datetime.date(2008, 1, 1)),
+             "2008-2015": ('Seattle_Police_Beats_2008-2015.shp', datetime.date(2008, 1, 1), datetime.date(2015, 1, 1)),
+             "2015-2017": ('Seattle_Police_Beats_2015-2017.shp', datetime.date(2015, 1, 1), datetime.date(2018, 1, 1)),
+             "2018-present": ('Seattle_Police_Beats_2018-present.shp', datetime.date(2018, 1, 1), None)}
+current_era = "2018-present"
+# Days the beats were redrawn: the first day of every era after the first
+beat_changes = [first for shapefile, first, last in beat_eras.values() if first is not None]
+# Folium (and GeoJSON) want lon/lat
+map_crs = 'EPSG:4326'
+# Washington State Plane North (US feet), for anything measured in distances or areas
+area_crs = 'EPSG:2926'
+# Simplification tolerance in feet for each resolution, coarsest first; "full" keeps every vertex
+simplify_tolerances = {"city": 200, "district": 50, "street": 10}
+# Most zoomed-out folium zoom level each resolution is good for
+resolution_zooms = {"city": 11, "district": 13, "street": 15}
+
+
+def assetFile(era, resolution = "full", path = asset_path):
+    return os.path.join(path, era + ('' if resolution == "full" else '_' + resolution) + '.parquet')
+
+
+def readShapefile(era, shapefile_dir = '.'):
+    import geopandas as gpd
+
+    beats = gpd.read_file(os.path.join(shapefile_dir, beat_eras[era][0]))
+    # Getting geodataframe into the same order as beat, and slicing out the "no beat" line
+    beats = beats.sort_values(by = "beat").iloc[1:, :].reset_index(drop = True)
+    if beats.crs is None:
+        beats = beats.set_crs(map_crs)
+    return beats.to_crs(map_crs)
+
+
+def buildAssets(shapefile_dir = '.', path = asset_path):
+    # Reading each era's shapefile once and writing every asset for it
+    os.makedirs(path, exist_ok = True)
+    for era in beat_eras:
+        beats = readShapefile(era, shapefile_dir)
+        # Representative point (approx center, always inside the beat) per https://stackoverflow.com/a/38902492/2880512
+        label_points = beats.geometry.representative_point()
+        beats["label_lat"] = label_points.y
+        beats["label_lon"] = label_points.x
+        beats.to_parquet(assetFile(era, path = path), index = False)
+        # Simplifying in feet rather than degrees so the tolerances mean the same thing everywhere
+        projected = beats[["beat", "geometry"]].to_crs(area_crs)
+        for resolution, tolerance in simplify_tolerances.items():
+            simplified = projected.copy()
+            simplified["geometry"] = projected.geometry.simplify(tolerance, preserve_topology = True)
+            simplified.to_crs(map_crs).to_parquet(assetFile(era, resolution, path), index = False)
+    loadBeats.cache_clear()
+
+
+def resolutionFor(zoom):
+    # Coarsest resolution that still looks right at a folium zoom level
+    for resolution, most_zoomed_out in resolution_zooms.items():
+        if zoom <= most_zoomed_out:
+            return resolution
+    return "full"
+
+
+@functools.lru_cache(maxsize = None)
+def loadBeats(era = current_era, resolution = "full", path = asset_path):
+    # One era's beats; "full" has every column from the shapefile plus label_lat and label_lon, the simplified
+    # resolutions just beat and geometry. Cached per process, so treat the result as read-only.
+    import geopandas as gpd
+
+    return gpd.read_parquet(assetFile(era, resolution, path))
@@ -0,0 +1,116 @@
+# Crosswalk between the four beat maps, so windows that straddle a beat change get a real answer.
+#
+# Beats were redrawn in 2008, 2015 and 2018, and until now a window within `window` days of one of those dates
+# just printed a CAUTION message. Here each era's beats are intersected with the current beats (using the
+# geodataframe's spatial index to find the candidate pairs), and the share of each old beat's area falling in
+# each current beat goes into a sparse matrix. Calls from any era can then be re-projected onto the current
+# beats with a single sparse matrix multiply - which assumes calls are spread evenly over a beat's area, the
+# best that can be done with beat-level locations.
+#
+# The beats come from the prebuilt assets (see beat_assets). Intersecting them still takes a while, so the
+# matrices are cached on disk and only rebuilt when one of the era's assets changes.
+
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from .beat_assets import area_crs, assetFile, beat_eras, current_era, loadBeats
+from .call_cube import dayRange
+from .call_rates import positionCodes, rate_columns
+from .locations import asset_path, crosswalk_path
+
+# matrix: sparse (source beats x target beats) share of each source beat's area inside each target beat
+# source_beats, target_beats: beat labels along each axis
+Crosswalk = namedtuple('Crosswalk', ['matrix', 'source_beats', 'target_beats'])
+
+
+def intersectBeats(source, target):
+    # Area-weighted crosswalk matrix between two geodataframes of beats
+    source = source.to_crs(area_crs) if source.crs is not None else source
+    target = target.to_crs(area_crs) if target.crs is not None else target
+    # Candidate pairs from the spatial index, so only beats that actually touch get intersected
+    source_index, target_index = target.sindex.query(source.geometry, predicate = 'intersects')
+    shared = source.geometry.values[source_index].intersection(target.geometry.values[target_index]).area
+    areas = source.geometry.area.to_numpy()
+    weights = shared / np.where(areas[source_index] > 0, areas[source_index], 1)
+    keep = weights > 0
+    return scipy.sparse.csr_matrix((weights[keep], (source_index[keep], target_index[keep])), shape = (len(source), len(target)))
+
+
+def assetStamp(era, asset_dir):
+    # Size and modification time of an era's beat asset, to tell when a cached crosswalk is stale
+    status = os.stat(assetFile(era, path = asset_dir))
+    return [status.st_size, int(status.st_mtime)]
+
+
+def loadCrosswalk(era, target = current_era, asset_dir = asset_path, path = crosswalk_path):
+    # Crosswalk from one era's beats to another's, from the cache if it's still current
+    name = os.path.join(path, era + '_to_' + target)
+    stamp = {"source": assetStamp(era, asset_dir), "target": assetStamp(target, asset_dir)}
+    if os.path.exists(name + '.json') and os.path.exists(name + '.npz'):
+        with open(name + '.json') as index_file:
+            index = json.load(index_file)
+        if index["stamp"] == stamp:
+            return Crosswalk(scipy.sparse.load_npz(name + '.npz'), index["source_beats"], index["target_beats"])
+
+    source = loadBeats(era, path = asset_dir)
+    if era == target:
+        # No need to intersect a map with itself (and pick up slivers from imprecise boundaries)
+        beats = source["beat"].tolist()
+        crosswalk = Crosswalk(scipy.sparse.identity(len(beats), format = 'csr'), beats, beats)
+    else:
+        target_beats = loadBeats(target, path = asset_dir)
+        crosswalk = Crosswalk(intersectBeats(source, target_beats), source["beat"].tolist(), target_beats["beat"].tolist())
+    os.makedirs(path, exist_ok = True)
+    scipy.sparse.save_npz(name + '.npz', crosswalk.matrix)
+    with open(name + '.json', 'w') as index_file:
+        json.dump({"stamp": stamp, "source_beats": crosswalk.source_beats, "target_beats": crosswalk.target_beats}, index_file)
+    return crosswalk
+
+
+def reprojectCounts(counts, crosswalk):
+    # Counts indexed by the crosswalk's source beats (e.g. from countBeforeAfter or windowCounts with
+    # geo_flag = crosswalk.source_beats) onto the target beats; beats missing from counts count as zero
+    aligned = counts.reindex(crosswalk.source_beats, fill_value = 0)
+    projected = crosswalk.matrix.T @ aligned.to_numpy(dtype = np.float64)
+    return pd.DataFrame(projected, index = pd.Index(crosswalk.target_beats, name = "beat"), columns = counts.columns)
+
+
+def eraSegments(first, last):
+    # Splitting days [first, last) at the beat changes: a list of (era, segment start, segment end)
+    segments = []
+    for era, (shapefile, era_first, era_last) in beat_eras.items():
+        start = first if era_first is None else max(first, pd.Timestamp(era_first))
+        end = last if era_last is None else min(last, pd.Timestamp(era_last))
+        if start < end:
+            segments.append((era, start, end))
+    return segments
+
+
+def crosswalkWindowCounts(cube, event_date, window, target = current_era, asset_dir = asset_path, path = crosswalk_path):
+    # Before/after counts on the target era's beats for a window that may straddle beat changes: each stretch of
+    # the window is counted on the beats in force at the time (off the count cube) and re-projected, then the
+    # stretches are added up. Same layout as call_cube.windowCounts, with fractional counts.
+    event_day = pd.Timestamp(event_date)
+    periods = {"before": (event_day - pd.Timedelta(days = window - 1), event_day),
+               "after": (event_day, event_day + pd.Timedelta(days = window))}
+    columns = [name + "_" + period for name in rate_columns for period in periods]
+    total = None
+    for period, (first, last) in periods.items():
+        for era, start, end in eraSegments(first, last):
+            crosswalk = loadCrosswalk(era, target, asset_dir, path)
+            counts = dayRange(cube, start, end)
+            rollup = positionCodes(cube.locations["Beat"], crosswalk.source_beats)
+            by_beat = np.zeros((len(crosswalk.source_beats), counts.shape[1]))
+            np.add.at(by_beat, rollup[rollup >= 0], counts[rollup >= 0])
+            table = pd.DataFrame(0.0, index = crosswalk.source_beats, columns = columns)
+            table["total_" + period] = by_beat.sum(axis = 1)
+            for index, source in enumerate(cube.sources):
+                table[source.lower() + "_" + period] = by_beat[:, index]
+            projected = reprojectCounts(table, crosswalk)
+            total = projected if total is None else total + projected
+    return total[[name + "_" + period for name in rate_columns for period in ["before", "after"]]]
@@ -0,0 +1,112 @@
+# Timing every stage of the pipeline on an export of a given size.
+#
+# Runs the same code the command line does - streaming ingest, cube build, window queries, the batch sweep,
+# significance and map rendering - with the timing hooks switched on, so each stage's wall time and peak
+# memory come from the same instrumentation a normal --timing run reports. Point it at a real export, or let
+# it generate a synthetic one (see synthetic) of 1M, 10M or 50M rows. Peak memory is per process, so run one
+# size per invocation:
+#
+#     for rows in 1M 10M 50M; do event-impact benchmark --rows $rows --output bench_$rows.json; done
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from . import timing
+from .beat_assets import assetFile, current_era
+from .call_cube import buildStoredCube, loadCube, saveCube, windowCounts
+from .call_rates import ratePercentages
+from .call_stats import eventSignificance
+from .call_store import ingestExport, memory_budget, sharedCalls
+from .event_batch import randomQueries, runQueries
+from .locations import asset_path
+from .synthetic import writeSynthetic
+
+window = 90
+batch_windows = [30, 90, 365]
+
+
+def runBenchmark(csv_path, work_dir, events = 20, queries = 10000, maps = 3, significance = 3,
+                 asset_dir = asset_path, budget = memory_budget, seed = 0):
+    # Every stage once over csv_path, keeping the store, cube and maps in work_dir. Returns
+    # {"rows": ..., "stages": {name: {"calls", "seconds", "peak_mb", "grew_mb"}}, "skipped": [...]}.
+    timing.reset()
+    enabled = timing.enabled
+    timing.enable()
+    try:
+        store = os.path.join(work_dir, 'call_store')
+        cube_dir = os.path.join(work_dir, 'call_cube')
+        rows = ingestExport(csv_path, store, budget)
+        saveCube(buildStoredCube(store), cube_dir)
+        cube = loadCube(cube_dir)
+
+        # The notebook's path (filter the calls to the window, then count) next to the cube's
+        sample = randomQueries(cube, events, [window], seed = seed)
+        for event in sample.itertuples(index = False):
+            with timing.stage('window filtering'):
+                within_window = sharedCalls(store, columns = ["Date Queued", "Call Source", "Precinct", "Sector", "Beat"],
+                                            start = event.event_date - pd.Timedelta(days = window - 1),
+                                            end = event.event_date + pd.Timedelta(days = window))
+            ratePercentages(within_window, event.event_date)
+            windowCounts(cube, event.event_date, window)
+
+        runQueries(randomQueries(cube, queries, batch_windows, seed = seed), cube)
+        for event in sample.head(significance).itertuples(index = False):
+            eventSignificance(cube, event.event_date, event.event_location, window, seed = seed)
+
+        skipped = []
+        if maps and os.path.exists(assetFile(current_era, path = asset_dir)):
+            from .call_maps import eventMapJobs, renderMaps
+
+            renderMaps(eventMapJobs(cube, sample.head(maps)), os.path.join(work_dir, 'maps'), processes = 1, asset_dir = asset_dir)
+        elif maps:
+            skipped.append('map rendering (no beat assets in ' + asset_dir + ')')
+        stages = {name: {"calls": calls, "seconds": round(seconds, 4), "peak_mb": round(peak, 1), "grew_mb": round(grew, 1)}
+                  for name, (calls, seconds, peak, grew) in timing.stages.items()}
+        return {"rows": rows, "stages": stages, "skipped": skipped}
+    finally:
+        timing.enable(enabled)
+
+
+def benchmarkRows(rows, work_dir, seed = 0, **options):
+    # runBenchmark on a synthetic export of rows calls, generated into work_dir unless it is already there. The
+    # export is written by a separate process so generating it doesn't count towards this one's peak memory.
+    csv_path = os.path.join(work_dir, 'synthetic_' + str(rows) + '_' + str(seed) + '.csv')
+    if not os.path.exists(csv_path):
+        os.makedirs(work_dir, exist_ok = True)
+        with ProcessPoolExecutor(max_workers = 1) as pool:
+            pool.submit(writeSynthetic, csv_path + '.tmp', rows, seed = seed).result()
+        os.replace(csv_path + '.tmp', csv_path)
+    return runBenchmark(csv_path, work_dir, seed = seed, **options)
+
+
+def saveResults(results, path):
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent = 1)
+
+
+def compareResults(results, baseline, tolerance = 0.2):
+    # Stages that got more than tolerance slower, or raised peak memory by more than tolerance, against an
+    # earlier run of the same size; differences under 50 ms or 10 MB are noise
+    if results["rows"] != baseline["rows"]:
+        raise ValueError('baseline is for ' + str(baseline["rows"]) + ' rows, not ' + str(results["rows"]))
+    regressions = []
+    for name, stage in results["stages"].items():
+        before = baseline["stages"].get(name)
+        if before is None:
+            continue
+        if stage["seconds"] > before["seconds"] * (1 + tolerance) + 0.05:
+            regressions.append(name + ': ' + str(stage["seconds"]) + ' s, was ' + str(before["seconds"]) + ' s')
+        if stage["grew_mb"] > max(before["grew_mb"], 1) * (1 + tolerance) + 10:
+            regressions.append(name + ': raised peak memory by ' + str(stage["grew_mb"]) + ' MB, was ' + str(before["grew_mb"]) + ' MB')
+    return regressions
+
+
+def resultLines(results):
+    lines = [str(results["rows"]) + ' rows']
+    lines.extend(timing.formatStages((name, stage["calls"], stage["seconds"], stage["peak_mb"], stage["grew_mb"])
+                                     for name, stage in results["stages"].items()))
+    lines.extend('skipped: ' + entry for entry in results["skipped"])
+    return lines
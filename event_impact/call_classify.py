@@ -0,0 +1,120 @@
+# Cleaning up and classifying the text columns of the call data: Call Type, Event Clearance Description, and
+# Initial and Final Call Type.
+#
+# callSource was applied to every row with linear `in` lookups against the call type lists. These columns
+# only hold a few hundred distinct values across millions of rows, so everything here works on the
+# categories instead: each distinct value is normalized and mapped once, and the result is broadcast back to
+# the rows by remapping the categorical codes. Reclassifying a loaded column takes milliseconds, and since the
+# mapping tables are plain dicts (or CSVs, for the crime type groups), changing the taxonomy means re-running
+# the mapping rather than re-reading the data.
+#
+# Shared by the notebook and by the ingest code in call_store, so a nightly delta gets exactly the same
+# classification as the full history did.
+
+import re
+
+import numpy as np
+import pandas as pd
+
+external_call_types_list = ["TELEPHONE OTHER, not 911", "911", "ALARM CALL (NOT POLICE ALARM)", "POLICE (VARDA ALARM)", "IN PERSON COMPLAINT", "TEXT MESSAGE"]
+internal_call_types_list = ["ONVIEW", "PROACTIVE (OFFICER INITIATED)", "SCHEDULED EVENT (RECURRING)"]
+call_source_categories = ["Internal", "External", "Other"]
+
+# Text columns cleaned up at ingest
+text_columns = ["Call Type", "Event Clearance Description", "Initial Call Type", "Final Call Type"]
+# Leading characters SPD uses as markers ("--ASSAULTS - ...", "* ...") that throw off sorting
+leading_punctuation = '-*.,:;!?\'" '
+whitespace = re.compile(r'\s+')
+
+# Editable crime type groups for Initial and Final Call Type, keyed by normalized call type. Anything not
+# listed falls back to the call type's own heading (the part before " - "); see groupTable and loadGroups for
+# keeping the table in a CSV.
+crime_type_groups = {}
+
+
+def normalizeCategory(x):
+    # Upper case, single spaces, no leading markers or padding; missing values stay missing
+    if not isinstance(x, str):
+        return None
+    x = whitespace.sub(' ', x).strip().lstrip(leading_punctuation).strip().upper()
+    return x or None
+
+
+def asCategorical(x):
+    x = pd.Series(x)
+    if isinstance(x.dtype, pd.CategoricalDtype):
+        return x
+    return x.astype('category')
+
+
+def recodeCategories(x, labels, categories = None):
+    # Broadcasting a new label for each category of x back to the rows through the codes. labels is aligned with
+    # x.cat.categories; None means missing. The new categories are sorted unless given explicitly.
+    labels = pd.Index(labels, dtype = object)
+    if categories is None:
+        categories = sorted(set(label for label in labels if label is not None))
+    positions = np.append(pd.Index(categories).get_indexer(labels), -1)
+    codes = positions[x.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories = categories), index = x.index, name = x.name)
+
+
+def normalizeCategories(x):
+    # x with every distinct value run through normalizeCategory; values that only differed by case, spacing or
+    # leading punctuation collapse into one category, and the categories come out sorted
+    x = asCategorical(x)
+    return recodeCategories(x, [normalizeCategory(category) for category in x.cat.categories])
+
+
+# Editable Call Source table, keyed by normalized Call Type; anything not listed is "Other"
+call_source_map = {normalizeCategory(entry): "Internal" for entry in internal_call_types_list}
+call_source_map.update({normalizeCategory(entry): "External" for entry in external_call_types_list})
+
+
+def callSource(x):
+    # Call Source for a single Call Type, from the same table as callSources
+    return call_source_map.get(normalizeCategory(x), "Other")
+
+
+def callSources(call_types, mapping = None):
+    # Call Source for a whole column of Call Types, looking each distinct type up once
+    if mapping is None:
+        mapping = call_source_map
+    call_types = asCategorical(call_types)
+    labels = [mapping.get(normalizeCategory(category), "Other") for category in call_types.cat.categories]
+    sources = recodeCategories(call_types, labels, call_source_categories)
+    # Missing call types are "Other" too, as callSource had it
+    return sources.fillna("Other")
+
+
+def defaultGroup(call_type):
+    # SPD call types mostly start with a heading, e.g. "ASSAULTS - HARASSMENT" or "TRAFFIC - MV COLLISION"
+    if call_type is None:
+        return None
+    return call_type.split(' - ', 1)[0].strip()
+
+
+def crimeGroups(call_types, groups = None):
+    # Crime type group for a column of Initial or Final Call Types, from the editable table with the heading
+    # as the fallback
+    if groups is None:
+        groups = crime_type_groups
+    call_types = asCategorical(call_types)
+    labels = []
+    for category in call_types.cat.categories:
+        normalized = normalizeCategory(category)
+        labels.append(groups.get(normalized, defaultGroup(normalized)))
+    return recodeCategories(call_types, labels)
+
+
+def groupTable(call_types, groups = None):
+    # Every distinct (normalized) call type with the group it currently lands in, ready to be written to CSV,
+    # edited, and read back with loadGroups
+    if groups is None:
+        groups = crime_type_groups
+    normalized = normalizeCategories(call_types).cat.categories
+    return pd.DataFrame({"call_type": normalized, "group": [groups.get(entry, defaultGroup(entry)) for entry in normalized]})
+
+
+def loadGroups(path):
+    table = pd.read_csv(path, dtype = str).dropna()
+    return {normalizeCategory(call_type): group for call_type, group in zip(table["call_type"], table["group"])}
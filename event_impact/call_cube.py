@@ -0,0 +1,184 @@
+# Precomputed daily call counts by location and call source.
+#
+# Every event query used to filter the full call data by date before counting anything. Instead, the calls are
+# counted once into a dense day x location x call source cube and summed cumulatively along the day axis, so
+# the count for any run of days is the difference of two slices: any before/after window for any event_date,
+# window and location comes out of a few array lookups without touching the row-level data.
+#
+# The location axis holds each (Precinct, Sector, Beat) combination seen in the data, so rolling beats up to
+# sectors or precincts uses the calls' own Precinct and Sector values and matches counting rows directly.
+# The cube is saved as .npy files plus a small JSON index, and loads memory-mapped so several processes can
+# share one copy in the page cache.
+
+import functools
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .call_rates import beat, call_sources, geoColumn, positionCodes, rate_columns
+from .call_store import loadCalls, storedMonths
+from .locations import cube_path, store_path
+from .timing import timed
+
+location_columns = ["Precinct", "Sector", "Beat"]
+
+# cumulative: (days + 1) x locations x call sources; cumulative[i] is the count for all days before first_day + i
+# first_day: Timestamp of day 0
+# locations: dataframe of the Precinct, Sector and Beat for each position on the location axis
+# sources: the call sources along the last axis
+Cube = namedtuple('Cube', ['cumulative', 'first_day', 'locations', 'sources'])
+
+
+def countDays(call_data, first_day, days, locations):
+    # Daily counts for call_data on an existing day and location axis; rows outside either are dropped
+    day_index = ((call_data["Date Queued"] - first_day) // pd.Timedelta(days = 1)).to_numpy(dtype = float)
+    location_keys = pd.MultiIndex.from_frame(call_data[location_columns].astype(object).fillna(''))
+    location_index = pd.MultiIndex.from_frame(locations).get_indexer(location_keys)
+    source_index = positionCodes(call_data["Call Source"], call_sources)
+    known = ~np.isnan(day_index) & (day_index >= 0) & (day_index < days) & (location_index >= 0) & (source_index >= 0)
+    keys = (day_index[known].astype(np.int64) * len(locations) + location_index[known]) * len(call_sources) + source_index[known]
+    counts = np.bincount(keys, minlength = days * len(locations) * len(call_sources))
+    return counts.reshape(days, len(locations), len(call_sources))
+
+
+def cumulativeCounts(counts):
+    # Prefixing a day of zeros so the count for days [a, b) is always cumulative[b] - cumulative[a]
+    cumulative = np.zeros((counts.shape[0] + 1,) + counts.shape[1:], dtype = np.int64)
+    np.cumsum(counts, axis = 0, out = cumulative[1:])
+    return cumulative
+
+
+@timed('cube build')
+def buildCube(call_data):
+    # call_data needs "Date Queued", "Call Source" and the location columns; loadCalls with just those columns
+    # keeps this to a fraction of the full dataset in memory
+    dated = call_data.loc[call_data["Date Queued"].notna()]
+    first_day = dated["Date Queued"].min()
+    days = (dated["Date Queued"].max() - first_day).days + 1
+    locations = dated[location_columns].astype(object).fillna('').drop_duplicates()
+    locations = locations.sort_values(location_columns).reset_index(drop = True)
+    counts = countDays(dated, first_day, days, locations)
+    return Cube(cumulativeCounts(counts), first_day, locations, list(call_sources))
+
+
+@timed('cube build')
+def buildStoredCube(path = store_path):
+    # buildCube over a whole call store a year of month partitions at a time, so memory is bounded by the
+    # busiest year rather than the history: one pass finds the day range and location axis, a second counts
+    years = sorted(set(int(month[:4]) for month in storedMonths(path)))
+    spans = [(pd.Timestamp(year, 1, 1), pd.Timestamp(year + 1, 1, 1)) for year in years]
+    first_day, last_day, locations = None, None, []
+    for start, end in spans:
+        calls = loadCalls(path, columns = ["Date Queued"] + location_columns, start = start, end = end)
+        calls = calls.loc[calls["Date Queued"].notna()]
+        if len(calls):
+            first_day = min(first_day, calls["Date Queued"].min()) if first_day is not None else calls["Date Queued"].min()
+            last_day = max(last_day, calls["Date Queued"].max()) if last_day is not None else calls["Date Queued"].max()
+            locations.append(calls[location_columns].astype(object).fillna('').drop_duplicates())
+    if first_day is None:
+        raise ValueError('no dated calls in ' + path)
+    days = (last_day - first_day).days + 1
+    locations = pd.concat(locations).drop_duplicates().sort_values(location_columns).reset_index(drop = True)
+    counts = np.zeros((days, len(locations), len(call_sources)), dtype = np.int64)
+    for start, end in spans:
+        calls = loadCalls(path, columns = ["Date Queued", "Call Source"] + location_columns, start = start, end = end)
+        counts += countDays(calls, first_day, days, locations)
+    return Cube(cumulativeCounts(counts), first_day, locations, list(call_sources))
+
+
+def saveCube(cube, path = cube_path):
+    # Writing to temporary names and renaming, so a process loading the cube never sees half a file
+    os.makedirs(path, exist_ok = True)
+    index = {"first_day": cube.first_day.strftime('%Y-%m-%d'),
+             "locations": cube.locations.values.tolist(),
+             "sources": cube.sources}
+    np.save(os.path.join(path, 'cumulative.tmp.npy'), np.asarray(cube.cumulative))
+    with open(os.path.join(path, 'index.tmp.json'), 'w') as index_file:
+        json.dump(index, index_file)
+    os.replace(os.path.join(path, 'cumulative.tmp.npy'), os.path.join(path, 'cumulative.npy'))
+    os.replace(os.path.join(path, 'index.tmp.json'), os.path.join(path, 'index.json'))
+    sharedCube.cache_clear()
+
+
+def loadCube(path = cube_path, mmap = True):
+    with open(os.path.join(path, 'index.json')) as index_file:
+        index = json.load(index_file)
+    cumulative = np.load(os.path.join(path, 'cumulative.npy'), mmap_mode = 'r' if mmap else None)
+    locations = pd.DataFrame(index["locations"], columns = location_columns)
+    return Cube(cumulative, pd.Timestamp(index["first_day"]), locations, index["sources"])
+
+
+@functools.lru_cache(maxsize = None)
+def sharedCube(path = cube_path):
+    # The memory-mapped cube, opened once per process and shared by everything that asks for it
+    return loadCube(path)
+
+
+@timed('cube build')
+def updateCube(new_calls, path = cube_path):
+    # Folding newly ingested calls (e.g. what ingestNewCalls returns) into the saved cube. The day and location
+    # axes grow as needed and the cumulative sums are rebuilt from the daily counts, which costs the size of
+    # the cube rather than the size of the call history.
+    cube = loadCube(path, mmap = False)
+    counts = np.diff(cube.cumulative, axis = 0)
+    new_calls = new_calls.loc[new_calls["Date Queued"].notna()]
+    if len(new_calls) == 0:
+        return cube
+    first_day = min(cube.first_day, new_calls["Date Queued"].min())
+    last_day = max(cube.first_day + pd.Timedelta(days = counts.shape[0] - 1), new_calls["Date Queued"].max())
+    days = (last_day - first_day).days + 1
+    new_locations = new_calls[location_columns].astype(object).fillna('').drop_duplicates()
+    locations = pd.concat([cube.locations, new_locations]).drop_duplicates()
+    locations = locations.sort_values(location_columns).reset_index(drop = True)
+
+    grown = np.zeros((days, len(locations), len(call_sources)), dtype = np.int64)
+    offset = (cube.first_day - first_day).days
+    old_positions = pd.MultiIndex.from_frame(locations).get_indexer(pd.MultiIndex.from_frame(cube.locations))
+    grown[offset:offset + counts.shape[0], old_positions, :] = counts
+    grown += countDays(new_calls, first_day, days, locations)
+    cube = Cube(cumulativeCounts(grown), first_day, locations, list(call_sources))
+    saveCube(cube, path)
+    return cube
+
+
+def dayRange(cube, first, last):
+    # Counts for days first through last - 1 (Timestamps) per location and call source; days off either end
+    # of the cube simply have no calls
+    days = cube.cumulative.shape[0] - 1
+    a = min(max((first - cube.first_day).days, 0), days)
+    b = min(max((last - cube.first_day).days, 0), days)
+    return np.asarray(cube.cumulative[b]) - np.asarray(cube.cumulative[a])
+
+
+def rollupMatrix(cube, geo_flag, geo_column):
+    # 0/1 matrix taking each location on the cube's axis to its position in geo_flag
+    rollup = positionCodes(cube.locations[geo_column], geo_flag)
+    membership = np.zeros((len(cube.locations), len(geo_flag)), dtype = np.int64)
+    membership[np.flatnonzero(rollup >= 0), rollup[rollup >= 0]] = 1
+    return membership
+
+
+@timed('rate aggregation')
+def windowCounts(cube, event_date, window, geo_flag = beat, geo_column = None):
+    # Same table as call_rates.countBeforeAfter over the notebook's within_window (days strictly between
+    # event_date - window and event_date + window; before is < event_date, after is >= event_date), from
+    # four slices of the cube
+    if geo_column is None:
+        geo_column = geoColumn(geo_flag)
+    event_day = pd.Timestamp(event_date)
+    before = dayRange(cube, event_day - pd.Timedelta(days = window - 1), event_day)
+    after = dayRange(cube, event_day, event_day + pd.Timedelta(days = window))
+    membership = rollupMatrix(cube, geo_flag, geo_column)
+
+    table = {}
+    for name in rate_columns:
+        for period, counts in [("before", before), ("after", after)]:
+            if name == "total":
+                by_location = counts.sum(axis = 1)
+            else:
+                by_location = counts[:, cube.sources.index(name.capitalize())]
+            table[name + "_" + period] = membership.T @ by_location
+    return pd.DataFrame(table, index = pd.Index(list(geo_flag), name = geo_column.lower()))
@@ -0,0 +1,154 @@
+# Batch choropleth maps of percentage change by beat.
+#
+# Each map used to be a folium.Map plus a Choropleth carrying its own copy of the beat geometry, with one DivIcon
+# Marker per beat added in a Python loop. Here the beat geometry (at the resolution the zoom level needs, from
+# beat_assets) is written once per output directory as a small script, and every map loads it with a <script>
+# tag (which, unlike fetching a GeoJSON file, also works when the maps are opened straight from disk). A map
+# only carries its own colour per beat and the values for its labels, and the labels come from one tooltip
+# layer built in the browser at each beat's label point. Maps are rendered across a process pool.
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import branca.colormap
+import folium
+import numpy as np
+import pandas as pd
+from branca.element import Element, JavascriptLink, MacroElement, Template
+
+from .beat_assets import current_era, loadBeats, resolutionFor
+from .call_cube import windowCounts
+from .call_rates import beat, percentChange
+from .locations import asset_path
+from .timing import timed
+
+map_center = [47.6, -122.3]
+zoom_start = 11
+# Same shading as the notebook's choropleth: 8 equal-width bins of PuBuGn
+bin_count = 8
+fill_colors = branca.colormap.linear.PuBuGn_09
+maps_per_task = 25
+
+
+def geometryScript(era, resolution):
+    return 'beats_' + era + '_' + resolution + '.js'
+
+
+def writeSharedGeometry(out_dir, era = current_era, resolution = None, zoom = zoom_start, asset_dir = asset_path):
+    # Writing the beats (geometry, beat and label point) once for every map in out_dir to reference
+    if resolution is None:
+        resolution = resolutionFor(zoom)
+    beats = loadBeats(era, resolution, asset_dir)
+    labels = loadBeats(era, path = asset_dir)[["beat", "label_lat", "label_lon"]]
+    beats = beats.merge(labels, on = "beat", how = "left")
+    name = geometryScript(era, resolution)
+    with open(os.path.join(out_dir, name), 'w') as script:
+        script.write('var spdBeats = ' + beats.to_json(drop_id = True) + ';\n')
+    return name
+
+
+class BeatLayer(MacroElement):
+    # Choropleth and label layer drawn in the browser from the shared geometry; only the colours and values for
+    # this map are embedded
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var colors = {{ this.colors }};
+            var values = {{ this.values }};
+            L.geoJson(spdBeats, {
+                style: function(feature) {
+                    var color = colors[feature.properties.beat];
+                    return {fillColor: color || '#ffffff', fillOpacity: color ? 0.7 : 0.1,
+                            color: 'black', weight: 1, opacity: 0.2};
+                }
+            }).addTo({{ this._parent.get_name() }});
+            var labels = L.layerGroup();
+            spdBeats.features.forEach(function(feature) {
+                var beat = feature.properties.beat;
+                var text = beat + (beat in values ? '<br>' + values[beat] : '');
+                labels.addLayer(L.tooltip({permanent: true, direction: 'center', className: 'beat-label'})
+                    .setLatLng([feature.properties.label_lat, feature.properties.label_lon]).setContent(text));
+            });
+            labels.addTo({{ this._parent.get_name() }});
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, colors, values):
+        super().__init__()
+        self._name = 'BeatLayer'
+        self.colors = json.dumps(colors)
+        self.values = json.dumps(values)
+
+
+def beatColors(values):
+    # Colour per beat from equal-width bins over this map's values; beats without a value are left out
+    values = values.dropna()
+    if values.empty:
+        return {}, None
+    edges = np.histogram_bin_edges(values.to_numpy(dtype = float), bins = bin_count)
+    if edges[0] == edges[-1]:
+        edges = np.array([edges[0] - 0.5, edges[0] + 0.5])
+    colormap = fill_colors.scale(edges[0], edges[-1]).to_step(index = list(edges))
+    return {beat: colormap(value) for beat, value in values.items()}, colormap
+
+
+def mapHtml(job, geometry_script, zoom = zoom_start):
+    # The map page for one job as HTML; job: {"percentages": table with a beat column, "call_source": column to
+    # shade, "title": legend caption (optional)}. geometry_script is the URL of the shared beat geometry.
+    percentages = job["percentages"]
+    values = percentages.set_index(percentages.columns[0])[job["call_source"]]
+    colors, colormap = beatColors(values)
+    mapviz = folium.Map(map_center, zoom_start = zoom)
+    mapviz.get_root().header.add_child(Element('<style>.beat-label {background: none; border: none; box-shadow: none; '
+                                               'font-size: 10px; text-align: center;}</style>'))
+    mapviz.get_root().html.add_child(JavascriptLink(geometry_script))
+    mapviz.add_child(BeatLayer(colors, {beat: str(round(value, 1)) + '%' for beat, value in values.dropna().items()}))
+    if colormap is not None:
+        colormap.caption = job.get("title", 'Change in ' + job["call_source"] + ' calls compared to before event (percentage)')
+        colormap.add_to(mapviz)
+    return mapviz.get_root().render()
+
+
+def renderMap(job, out_dir, geometry_script, zoom = zoom_start):
+    # Writing mapHtml for job (which also needs a "name", the file stem) into out_dir
+    file_name = os.path.join(out_dir, job["name"] + '.html')
+    with open(file_name, 'w', encoding = 'utf-8') as page:
+        page.write(mapHtml(job, geometry_script, zoom))
+    return file_name
+
+
+def renderChunk(jobs, out_dir, geometry_script, zoom):
+    return [renderMap(job, out_dir, geometry_script, zoom) for job in jobs]
+
+
+@timed('map rendering')
+def renderMaps(jobs, out_dir, era = current_era, zoom = zoom_start, processes = None, asset_dir = asset_path):
+    # Rendering every job into out_dir, sharing one copy of the beat geometry; returns the HTML file names.
+    # processes = 1 renders in this process, otherwise across a pool (default: one worker per CPU).
+    jobs = list(jobs)
+    os.makedirs(out_dir, exist_ok = True)
+    geometry_script = writeSharedGeometry(out_dir, era, zoom = zoom, asset_dir = asset_dir)
+    chunks = [jobs[i:i + maps_per_task] for i in range(0, len(jobs), maps_per_task)]
+    if processes == 1 or len(chunks) <= 1:
+        return [name for chunk in chunks for name in renderChunk(chunk, out_dir, geometry_script, zoom)]
+    with ProcessPoolExecutor(max_workers = processes) as pool:
+        rendered = pool.map(renderChunk, chunks, [out_dir] * len(chunks), [geometry_script] * len(chunks), [zoom] * len(chunks))
+        return [name for chunk in rendered for name in chunk]
+
+
+def eventMapJobs(cube, events, call_sources = ("external",), geo_flag = beat):
+    # One job per event and call source, with the percentages from the count cube. events is a table with
+    # event_date, window and (optionally) event_location columns, like event_batch's queries.
+    jobs = []
+    for event in events.itertuples(index = False):
+        percentages = percentChange(windowCounts(cube, event.event_date, event.window, geo_flag))
+        stem = pd.Timestamp(event.event_date).strftime('%Y-%m-%d') + '_' + str(event.window)
+        if hasattr(event, "event_location"):
+            stem = stem + '_' + str(event.event_location)
+        for call_source in call_sources:
+            jobs.append({"name": stem + '_' + call_source, "percentages": percentages, "call_source": call_source,
+                         "title": 'Change in ' + call_source + ' calls for ' + str(event.window) + ' days after versus before '
+                                  + pd.Timestamp(event.event_date).strftime('%Y-%m-%d') + ' (percentage)'})
+    return jobs
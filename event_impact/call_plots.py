@@ -0,0 +1,20 @@
+# The notebook's boxplot of percentage change by call source, with the event location marked.
+#
+# Only the plot command imports this module, so seaborn and matplotlib stay out of everything else.
+
+import matplotlib.pyplot as plt
+import seaborn as sbn
+
+
+def percentageBoxplot(percentages, event_location, event_date, window):
+    # Box plot of percentage change for all locations, with the location of interest on top as a black dot
+    location_column = percentages.columns[0]
+    figure, data_plot = plt.subplots()
+    sbn.boxplot(data = percentages.drop(columns = location_column), ax = data_plot)
+    location_of_interest = percentages.loc[percentages[location_column] == event_location].iloc[0, 1:]
+    data_plot.scatter(range(len(location_of_interest)), location_of_interest.to_numpy(dtype = float), color = "black", zorder = 3)
+    data_plot.set_xlabel("Call Source")
+    data_plot.set_ylabel("Percentage change")
+    data_plot.set_title("Percentage change in calls for " + str(window) + " days after versus before " + str(event_date) +
+                        "\nfor all " + location_column + "s (boxplot) and " + str(event_location) + " (black dot)")
+    return figure
@@ -0,0 +1,72 @@
+# Before/after call counts and percentage changes by location.
+#
+# The "Getting rates" cell built eight list comprehensions, each one rescanning within_window with a fresh
+# boolean mask for every entry in geo_flag - roughly 400 full passes for the beat level. Here every row is
+# given a single integer key (location, call source, before/after) and all the counts come out of one
+# np.bincount over the window. Locations with no calls still get a row of zeros.
+
+import numpy as np
+import pandas as pd
+
+from .locations import beat, call_sources, geo_columns, rate_columns
+from .timing import timed
+
+
+def geoColumn(geo_flag):
+    # Working out which column geo_flag refers to, so callers can keep passing the list itself
+    for column, locations in geo_columns.items():
+        if list(geo_flag) == locations:
+            return column
+    raise ValueError('geo_flag must be one of precinct, sector or beat (or pass geo_column explicitly)')
+
+
+def positionCodes(x, labels):
+    # Position of each value of x in labels, -1 for anything not in labels (including missing values). For
+    # categoricals only the categories are looked up and the codes are remapped.
+    labels = pd.Index(list(labels))
+    if isinstance(x.dtype, pd.CategoricalDtype):
+        category_positions = np.append(labels.get_indexer(x.cat.categories), -1)
+        return category_positions[x.cat.codes.to_numpy()].astype(np.int64)
+    return labels.get_indexer(x).astype(np.int64)
+
+
+@timed('rate aggregation')
+def countBeforeAfter(within_window, event_date, geo_flag = beat, geo_column = None):
+    # Counts of calls before (< event_date) and after (>= event_date) per location and call source, in one
+    # pass over within_window. Returns a dataframe indexed by geo_flag with columns total_before,
+    # total_after, internal_before, ... other_after.
+    if geo_column is None:
+        geo_column = geoColumn(geo_flag)
+    locations = positionCodes(within_window[geo_column], geo_flag)
+    # Anything outside the three sources gets its own slot so it still lands in "total"
+    sources = positionCodes(within_window["Call Source"], call_sources)
+    sources[sources < 0] = len(call_sources)
+    after = (within_window["Date Queued"] >= pd.Timestamp(event_date)).to_numpy().astype(np.int64)
+    known = locations >= 0
+    keys = (locations[known] * (len(call_sources) + 1) + sources[known]) * 2 + after[known]
+    counts = np.bincount(keys, minlength = len(geo_flag) * (len(call_sources) + 1) * 2)
+    counts = counts.reshape(len(geo_flag), len(call_sources) + 1, 2)
+
+    by_source = {"total": counts.sum(axis = 1)}
+    for index, source in enumerate(call_sources):
+        by_source[source.lower()] = counts[:, index, :]
+    table = {}
+    for name in rate_columns:
+        table[name + "_before"] = by_source[name][:, 0]
+        table[name + "_after"] = by_source[name][:, 1]
+    return pd.DataFrame(table, index = pd.Index(list(geo_flag), name = geo_column.lower()))
+
+
+def percentChange(counts):
+    # Percentage change from before to after; a location with no calls before is divided by 1 instead of 0
+    changes = {counts.index.name: counts.index.to_list()}
+    for name in rate_columns:
+        before = counts[name + "_before"].to_numpy()
+        after = counts[name + "_after"].to_numpy()
+        changes[name] = (after - before) / np.maximum(before, 1) * 100
+    return pd.DataFrame(changes)
+
+
+def ratePercentages(within_window, event_date, geo_flag = beat, geo_column = None):
+    # The notebook's percentages table: one row per location, percentage change for each call source
+    return percentChange(countBeforeAfter(within_window, event_date, geo_flag, geo_column))
@@ -0,0 +1,117 @@
+# Significance of an event's before/after change in calls, by call source.
+#
+# The notebook's check is a single population z-score of the event location's change against the other
+# locations, printed with a verdict at |z| > 2. Here the same comparison is backed by resampling, all done in
+# NumPy off the count cube rather than the row-level data:
+# * placebo dates - the location's change relative to the average of the other locations, recomputed for many
+#   random event dates whose windows don't overlap the real one
+# * placebo locations - the same relative change for every other location on the real event date
+# * bootstrap intervals - the location's percentage change and its relative change, with the days of the before
+#   and after windows resampled with replacement
+# Results come back as a dataframe, one row per call source, so many events can be checked programmatically.
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .call_rates import beat, geoColumn, positionCodes, rate_columns
+from .event_batch import chunk_size, rollupCumulative, windowChanges
+from .timing import timed
+
+resamples = 10000
+confidence = 0.95
+
+# table: dataframe indexed by call source (total, internal, external, other) with the location's change,
+#   its difference from the average of the other locations ("effect"), the notebook's z-score, both permutation p-values
+#   and the bootstrap intervals for the change and the effect
+# placebo_dates: number of distinct placebo event dates actually used
+Significance = namedtuple('Significance', ['table', 'placebo_dates'])
+
+
+def relativeChanges(changes):
+    # Each location's change minus the mean change of every other location; changes is ... x locations x sources
+    others = (changes.sum(axis = -2, keepdims = True) - changes) / (changes.shape[-2] - 1)
+    return changes - others
+
+
+def permutationPValue(observed, placebos):
+    # Two-sided; the observed value counts as one of the permutations so p is never 0
+    return (1 + (np.abs(placebos) >= np.abs(observed)).sum(axis = 0)) / (1 + placebos.shape[0])
+
+
+def placeboDates(cube, event_index, window, count, rng):
+    # Distinct day indices for placebo events: the whole window has to fit in the cube and not overlap the real
+    # one. Every candidate day is used when there are no more than count of them.
+    days = cube.cumulative.shape[0] - 1
+    candidates = np.arange(window - 1, days - window + 1)
+    candidates = candidates[np.abs(candidates - event_index) >= 2 * window]
+    return rng.choice(candidates, min(count, len(candidates)), replace = False)
+
+
+def bootstrapSums(daily, count, rng):
+    # Window totals for `count` resamples of its days, days x ... -> count x ...; drawing days with replacement
+    # is the same as giving each day a multinomial weight, so every resample is one row of a matrix product
+    weights = rng.multinomial(len(daily), np.full(len(daily), 1 / len(daily)), size = count).astype(np.float64)
+    return (weights @ daily.reshape(len(daily), -1)).reshape((count,) + daily.shape[1:])
+
+
+@timed('significance')
+def eventSignificance(cube, event_date, event_location, window, geo_flag = beat, geo_column = None,
+                      count = resamples, level = confidence, seed = None):
+    if geo_column is None:
+        geo_column = geoColumn(geo_flag)
+    if window < 2:
+        raise ValueError('window must be at least 2 days to have any days before the event')
+    rng = np.random.default_rng(seed)
+    rolled = rollupCumulative(cube, geo_flag, geo_column)
+    location_index = positionCodes(pd.Series([event_location]), geo_flag)[0]
+    if location_index < 0:
+        raise ValueError('event_location not in geo_flag: ' + str(event_location))
+    event_index = (pd.Timestamp(event_date) - cube.first_day).days
+    # The whole window has to be in the cube, as it is for the placebo dates; a window cut short by either end
+    # would compare a few days against many and look like a change
+    days = cube.cumulative.shape[0] - 1
+    if event_index - window + 1 < 0 or event_index + window > days:
+        raise ValueError('the window around ' + pd.Timestamp(event_date).strftime('%Y-%m-%d') + ' runs past the call data ('
+                         + cube.first_day.strftime('%Y-%m-%d') + ' to '
+                         + (cube.first_day + pd.Timedelta(days = days - 1)).strftime('%Y-%m-%d') + ')')
+
+    # The real event, with the notebook's z-score alongside
+    changes = windowChanges(rolled, np.array([event_index]), window)[0]
+    relative = relativeChanges(changes)
+    observed = relative[location_index]
+    z = (changes[location_index] - changes.mean(axis = 0)) / changes.std(axis = 0, ddof = 0)
+    p_locations = permutationPValue(observed, np.delete(relative, location_index, axis = 0))
+
+    # Placebo dates, in chunks to keep the gathered cube slices a sensible size
+    dates = placeboDates(cube, event_index, window, count, rng)
+    placebo = [relativeChanges(windowChanges(rolled, dates[i:i + chunk_size], window))[:, location_index, :]
+               for i in range(0, len(dates), chunk_size)]
+    p_dates = permutationPValue(observed, np.concatenate(placebo)) if placebo else np.full(len(rate_columns), np.nan)
+
+    # Bootstrap over the days of each window, resampling the same days for every location
+    first, middle, last = event_index - window + 1, event_index, event_index + window
+    daily = np.diff(rolled[first:last + 1], axis = 0)
+    before = bootstrapSums(daily[:middle - first], count, rng)
+    after = bootstrapSums(daily[middle - first:], count, rng)
+    boot_changes = (after - before) / np.maximum(before, 1) * 100
+    boot_change = boot_changes[:, location_index, :]
+    boot_effect = relativeChanges(boot_changes)[:, location_index, :]
+    tails = [(1 - level) / 2 * 100, (1 + level) / 2 * 100]
+    change_interval = np.percentile(boot_change, tails, axis = 0)
+    effect_interval = np.percentile(boot_effect, tails, axis = 0)
+
+    source_order = ["total"] + [source.lower() for source in cube.sources]
+    order = [source_order.index(name) for name in rate_columns]
+    table = pd.DataFrame({"change": changes[location_index, order],
+                          "effect": observed[order],
+                          "z": z[order],
+                          "p_placebo_dates": p_dates[order],
+                          "p_placebo_locations": p_locations[order],
+                          "change_low": change_interval[0, order],
+                          "change_high": change_interval[1, order],
+                          "effect_low": effect_interval[0, order],
+                          "effect_high": effect_interval[1, order]},
+                         index = pd.Index(rate_columns, name = "call_source"))
+    return Significance(table, len(dates))
@@ -0,0 +1,225 @@
+# Typed, partitioned storage for the cleaned 911 call data.
+#
+# Reading Call_Data.csv means parsing millions of rows of object strings every run, and the old
+# "911 reports modified.txt" dump didn't save any of that work on the next load. Instead, the cleaned
+# dataframe is written once to Parquet, partitioned by the month of "Original Time Queued", with the
+# repeating columns stored as categoricals and the times stored as actual datetimes. Later loads only
+# read the columns and months a query needs, so a 90 day window around event_date is a handful of
+# small files rather than the whole history.
+
+import functools
+import os
+import shutil
+
+import pandas as pd
+
+from .call_classify import asCategorical, call_source_categories, callSources, normalizeCategories, text_columns
+from .call_times import parseDays, parseTimestamps
+from .locations import store_path
+from .timing import stage, timed, timedIterator
+
+# Columns with a small set of repeated values; categoricals are a fraction of the size of object strings
+category_columns = ["Call Type", "Event Clearance Description", "Initial Call Type", "Final Call Type",
+                    "Priority", "Precinct", "Sector", "Beat", "Call Source"]
+date_columns = ["Original Time Queued", "Arrived Time", "Date Queued"]
+# Hive-style partition key, e.g. call_store/queued_month=2015-04/
+partition_column = "queued_month"
+
+# Reading an SPD export: only the columns the store keeps, with compact dtypes at parse time. The repeated
+# columns become categoricals straight out of the reader and the times stay strings only until each chunk is
+# parsed, so a chunk never holds the whole row as object strings.
+export_dtypes = {"CAD Event Number": "int64", "Original Time Queued": str, "Arrived Time": str}
+export_dtypes.update({column: "category" for column in category_columns if column != "Call Source"})
+# Bytes of memory a streaming ingest may use for its chunks, and how many times a chunk's own size is held
+# while it is read, classified, parsed and written (raw chunk, prepared copy, the date parser's working arrays
+# and the Arrow table); measured with the benchmark's peak memory per stage
+memory_budget = 512 * 2**20
+chunk_overhead = 7
+
+
+def monthKey(x):
+    # Partition key for a date, datetime or Timestamp; zero-padded so string ordering is date ordering
+    return pd.Timestamp(x).strftime('%Y-%m')
+
+
+def categoryValues(x):
+    # Categories are always stored as strings, so a full CSV load (where pandas reads Priority as numbers) and
+    # a nightly export read as text land with the same schema in the store. Only the categories are touched.
+    x = asCategorical(x)
+    categories = x.cat.categories
+    if pd.api.types.is_numeric_dtype(categories):
+        return x.cat.rename_categories([str(category) for category in categories.astype('Int64')])
+    if not all(isinstance(category, str) for category in categories):
+        return x.cat.rename_categories([str(category) for category in categories])
+    return x
+
+
+def prepareCalls(call_data, copy = True):
+    # Casting the cleaned dataframe to the stored dtypes; call_data itself is left untouched unless copy is
+    # False (a chunk nobody else holds)
+    prepared = call_data.copy() if copy else call_data
+    with stage('date parsing'):
+        for column in date_columns:
+            if column in prepared.columns and not pd.api.types.is_datetime64_any_dtype(prepared[column]):
+                prepared[column] = parseTimestamps(prepared[column]).timestamps
+        if "Date Queued" not in prepared.columns:
+            prepared["Date Queued"] = prepared["Original Time Queued"].dt.normalize()
+    with stage('classification'):
+        # Whitespace, case and leading punctuation cleaned up once per distinct value
+        for column in text_columns:
+            if column in prepared.columns:
+                prepared[column] = normalizeCategories(prepared[column])
+        if "Call Source" not in prepared.columns:
+            prepared["Call Source"] = callSources(prepared["Call Type"])
+    for column in category_columns:
+        if column in prepared.columns:
+            if column == "Call Source":
+                prepared[column] = pd.Categorical(prepared[column], categories = call_source_categories)
+            else:
+                prepared[column] = categoryValues(prepared[column])
+    # Rows without a queue time can't be placed in a window, so they can't be placed in a partition either
+    prepared = prepared.loc[prepared["Original Time Queued"].notna()]
+    prepared[partition_column] = prepared["Original Time Queued"].dt.strftime('%Y-%m')
+    return prepared
+
+
+def ingestCalls(call_data, path = store_path):
+    # Writing the whole cleaned dataset, replacing whatever was stored before
+    prepared = prepareCalls(call_data)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    with stage('store write'):
+        prepared.to_parquet(path, partition_cols = [partition_column], index = False)
+    cachedCalls.cache_clear()
+    return len(prepared)
+
+
+def appendCalls(call_data, path = store_path, copy = True):
+    # Adding cleaned rows to the store; each write lands as new files inside the month partitions it touches,
+    # so nothing already stored is rewritten
+    prepared = prepareCalls(call_data, copy)
+    if len(prepared):
+        with stage('store write'):
+            prepared.to_parquet(path, partition_cols = [partition_column], index = False)
+        cachedCalls.cache_clear()
+    return prepared
+
+
+def storedMonths(path = store_path):
+    if not os.path.exists(path):
+        return []
+    return sorted(name.split('=', 1)[1] for name in os.listdir(path) if name.startswith(partition_column + '='))
+
+
+def latestStoredDate(path = store_path):
+    # Newest "Date Queued" in the store; only the last month's partition has to be opened to find it
+    months = storedMonths(path)
+    if not months:
+        return None
+    last_month = pd.read_parquet(os.path.join(path, partition_column + '=' + months[-1]), columns = ["Date Queued"])
+    return last_month["Date Queued"].max()
+
+
+def exportColumn(column):
+    # Columns the store keeps; anything else in the export is never parsed (and a missing one isn't an error)
+    return column in export_dtypes
+
+
+def chunkRows(export_file, budget = memory_budget, sample_rows = 10000):
+    # Rows per chunk so that chunk_overhead copies of a chunk fit in budget, measured on the first sample_rows
+    # rows of the export as they will actually be read
+    sample = pd.read_csv(export_file, usecols = exportColumn, dtype = export_dtypes, nrows = sample_rows)
+    row_bytes = sample.memory_usage(deep = True).sum() / max(len(sample), 1)
+    return max(int(budget / (row_bytes * chunk_overhead)), 1000)
+
+
+def exportChunks(export_file, budget = memory_budget):
+    # The export as a sequence of compact dataframes, each sized to the memory budget
+    chunks = pd.read_csv(export_file, usecols = exportColumn, dtype = export_dtypes, chunksize = chunkRows(export_file, budget))
+    return timedIterator('load', chunks)
+
+
+def ingestExport(export_file, path = store_path, budget = memory_budget):
+    # Streaming version of ingestCalls for exports too big to load at once: the store is replaced, and each
+    # chunk is classified, date-parsed and appended before the next one is read, so peak memory is set by
+    # budget rather than by the size of the export. Returns the number of calls stored.
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    stored = 0
+    for chunk in exportChunks(export_file, budget):
+        stored += len(appendCalls(chunk, path, copy = False))
+    return stored
+
+
+def ingestNewCalls(export_file, path = store_path, budget = memory_budget):
+    # Incremental ingest from a fresh SPD export (a local file drop). Only rows at or after the newest stored
+    # date are kept (judged by the date part of each string, so the history is never fully date-parsed), CAD
+    # Event Numbers that are already stored are dropped, and only the remaining rows are parsed, classified and
+    # appended, so a nightly refresh costs about a day of calls rather than the whole history.
+    # The export is read in chunks within budget, since it usually holds the whole history.
+    # Returns the rows that were appended, for updating anything derived from the store.
+    latest = latestStoredDate(path)
+    already_stored = pd.Series([], dtype = "Int64")
+    if latest is not None:
+        # The newest stored day is usually only partly downloaded, so it overlaps with the export
+        already_stored = loadCalls(path, columns = ["CAD Event Number"], start = latest)["CAD Event Number"]
+    appended = []
+    for new_calls in exportChunks(export_file, budget):
+        if latest is not None:
+            # The history is dropped by the date part of each string before anything is fully parsed; rows whose
+            # date part doesn't parse on its own are kept for the full parse to decide
+            with stage('date parsing'):
+                days = parseDays(new_calls["Original Time Queued"])
+            new_calls = new_calls.loc[~(days < latest)]
+        new_calls = new_calls.loc[~new_calls["CAD Event Number"].isin(already_stored)]
+        new_calls = new_calls.drop_duplicates(subset = ["CAD Event Number"])
+        if len(new_calls) == 0:
+            continue
+        with stage('date parsing'):
+            parsed_times = parseTimestamps(new_calls["Original Time Queued"])
+        new_calls["Original Time Queued"] = parsed_times.timestamps
+        new_calls["Date Queued"] = parsed_times.timestamps.dt.normalize()
+        if latest is not None:
+            new_calls = new_calls.loc[new_calls["Date Queued"] >= latest]
+            if len(new_calls) == 0:
+                continue
+        # Classification (Call Source) happens in prepareCalls, on just these rows
+        appended.append(appendCalls(new_calls, path, copy = False))
+        # An export can repeat a call across chunks
+        already_stored = pd.concat([already_stored, appended[-1]["CAD Event Number"]], ignore_index = True)
+    if not appended:
+        return prepareCalls(new_calls.iloc[:0])
+    return pd.concat(appended, ignore_index = True)
+
+
+@timed('store read')
+def loadCalls(path = store_path, columns = None, start = None, end = None):
+    # Loading calls queued in [start, end); either bound can be left off. Month partitions outside the
+    # range are never opened, and the row-level filter on "Original Time Queued" is pushed down to the
+    # reader so rows outside the range are dropped before they become a dataframe.
+    filters = []
+    if start is not None:
+        filters.append((partition_column, ">=", monthKey(start)))
+        filters.append(("Original Time Queued", ">=", pd.Timestamp(start)))
+    if end is not None:
+        filters.append((partition_column, "<=", monthKey(end)))
+        filters.append(("Original Time Queued", "<", pd.Timestamp(end)))
+    if columns is not None:
+        columns = list(columns)
+    calls = pd.read_parquet(path, columns = columns, filters = filters or None)
+    if partition_column in calls.columns and (columns is None or partition_column not in columns):
+        calls = calls.drop(columns = partition_column)
+    return calls.reset_index(drop = True)
+
+
+@functools.lru_cache(maxsize = 8)
+def cachedCalls(path, columns, start, end):
+    return loadCalls(path, columns, start, end)
+
+
+def sharedCalls(path = store_path, columns = None, start = None, end = None):
+    # loadCalls memoized per process; the cache is dropped whenever the store is written. Columns become a tuple
+    # and the bounds Timestamps, so they can be cache keys and a date and its Timestamp share an entry. Treat the
+    # result as read-only, since every caller gets the same dataframe.
+    return cachedCalls(path, None if columns is None else tuple(columns), None if start is None else pd.Timestamp(start),
+                       None if end is None else pd.Timestamp(end))
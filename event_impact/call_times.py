@@ -0,0 +1,100 @@
+# Bulk timestamp parsing for the SPD call data.
+#
+# timeConversion ran datetime.strptime once per row, used %H alongside %p (so every PM time came out as AM),
+# and its fallback called pd.to_datetime and threw the result away. The same timestamp string shows up many
+# times over in the call data, so here each distinct string is parsed exactly once: the known
+# MM/DD/YYYY HH:MM:SS AM/PM format is decoded for all of them at once straight from the bytes, and only the
+# strings that don't fit it are handed to the slower, flexible parsers. The results are then broadcast back
+# to the rows by their codes.
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# %I (12 hour clock) rather than %H, otherwise %p is ignored
+time_format = '%m/%d/%Y %I:%M:%S %p'
+# Character positions in MM/DD/YYYY HH:MM:SS AM
+time_width = 22
+day_width = 10
+digit_positions = [0, 1, 3, 4, 6, 7, 8, 9, 11, 12, 14, 15, 17, 18]
+separators = {2: b'/', 5: b'/', 10: b' ', 13: b':', 16: b':', 19: b' ', 21: b'M'}
+
+# timestamps: datetime64 Series aligned with the input; unparseable entries are NaT
+# failed_count: number of rows that had a value but couldn't be parsed by any path
+# failed_sample: a few of those rows (original strings, original index) for eyeballing
+ParsedTimes = namedtuple('ParsedTimes', ['timestamps', 'failed_count', 'failed_sample'])
+
+
+def parseFixedFormat(x):
+    # Decoding MM/DD/YYYY HH:MM:SS AM/PM strings with array arithmetic on their bytes. pd.to_datetime with a
+    # 12 hour format goes through a per-element strptime, which is most of the cost on millions of strings.
+    # Returns datetime64[s] values, NaT wherever the string doesn't fit the format exactly.
+    x = np.asarray(x, dtype = object)
+    result = np.full(len(x), np.datetime64('NaT'), dtype = 'datetime64[s]')
+    lengths = pd.Series(x, dtype = object).str.len().to_numpy()
+    fits = lengths == time_width
+    if not fits.any():
+        return result
+    try:
+        raw = np.array(x[fits].tolist(), dtype = 'S%d' % time_width)
+    except UnicodeEncodeError:
+        # Nothing in this format has non-ASCII characters; let the flexible parser sort it out
+        return result
+    chars = raw.view(np.uint8).reshape(-1, time_width)
+    # int16 is plenty for single digits and four-digit years, and keeps this at a quarter of the memory
+    digits = chars[:, digit_positions].astype(np.int16) - ord('0')
+    ok = ((digits >= 0) & (digits <= 9)).all(axis = 1)
+    for position, character in separators.items():
+        ok &= chars[:, position] == ord(character)
+    meridian = chars[:, 20]
+    ok &= (meridian == ord('A')) | (meridian == ord('P'))
+
+    month = digits[:, 0] * 10 + digits[:, 1]
+    day = digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4] * 1000 + digits[:, 5] * 100 + digits[:, 6] * 10 + digits[:, 7]
+    hour = digits[:, 8] * 10 + digits[:, 9]
+    minute = digits[:, 10] * 10 + digits[:, 11]
+    second = digits[:, 12] * 10 + digits[:, 13]
+    ok &= (month >= 1) & (month <= 12) & (day >= 1) & (hour >= 1) & (hour <= 12) & (minute < 60) & (second < 60)
+
+    # 12 AM is midnight and 12 PM is noon
+    hour = hour % 12 + np.where(meridian == ord('P'), 12, 0)
+    months = ((year.astype(np.int64) - 1970) * 12 + np.clip(month, 1, 12) - 1).astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + (day - 1)
+    # Rolling into the next month means the day doesn't exist (e.g. 02/30)
+    ok &= days.astype('datetime64[M]') == months
+    seconds = days.astype('datetime64[s]') + (hour.astype(np.int64) * 3600 + minute * 60 + second)
+    seconds[~ok] = np.datetime64('NaT')
+    result[fits] = seconds
+    return result
+
+
+def parseDays(x):
+    # Day of each MM/DD/YYYY HH:MM:SS AM/PM string from its date part alone, NaT wherever the first ten
+    # characters aren't a date (unpadded or other formats, missing values). A call history only spans a few
+    # thousand days, so each distinct date part is parsed once; this is for cheaply dropping rows by day before
+    # the full parse, not a substitute for it.
+    codes, uniques = pd.factorize(pd.Series(x).str.slice(0, day_width), use_na_sentinel = True)
+    days = pd.to_datetime(pd.Series(uniques, dtype = object), format = '%m/%d/%Y', errors = 'coerce')
+    return pd.Series(days.array.take(codes, allow_fill = True), index = pd.Series(x).index)
+
+
+def parseTimestamps(x, sample_size = 10):
+    values = pd.Series(x)
+    # codes maps each row to its distinct string; missing values get -1
+    codes, uniques = pd.factorize(values, use_na_sentinel = True)
+    uniques = pd.Series(uniques, dtype = object)
+    parsed = pd.Series(parseFixedFormat(uniques))
+    retry = parsed.isna()
+    if retry.any():
+        # Slower paths that can deal with variations in format to a certain extent; only the misfits go here
+        retried = pd.to_datetime(uniques[retry].astype(str), format = time_format, errors = 'coerce')
+        still_failed = retried.isna()
+        if still_failed.any():
+            retried[still_failed] = pd.to_datetime(uniques[retry][still_failed].astype(str), format = 'mixed', errors = 'coerce')
+        parsed[retry] = retried
+    # Broadcasting back to the rows; -1 codes (missing values) come out as NaT
+    timestamps = pd.Series(parsed.array.take(codes, allow_fill = True), index = values.index, name = values.name)
+    failed = timestamps.isna() & (codes >= 0)
+    return ParsedTimes(timestamps, int(failed.sum()), values[failed].head(sample_size))
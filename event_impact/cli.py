@@ -0,0 +1,279 @@
+# The event-impact command line.
+#
+# Every subcommand imports what it needs when it runs, so the common text-only query (report) starts without
+# loading pandas, and only the assets, maps and plot subcommands ever import geopandas, folium, seaborn or
+# matplotlib.
+#
+#     event-impact ingest Call_Data.csv            full load into the store (streamed in chunks), then build the cube
+#     event-impact update new_calls.csv            nightly delta: append new calls and update the cube
+#     event-impact report --date 2015-04-05 --location B2
+#     event-impact batch --random 10000 --windows 30,90,365 --output sweep.csv
+#     event-impact assets --shapefiles shapefiles/
+#     event-impact maps --dates 2015-04-05 --sources external,internal --output maps/
+#     event-impact plot --date 2015-04-05 --location B2 --output boxplot.png
+#     event-impact synthetic --rows 10M --output calls_10M.csv
+#     event-impact benchmark --rows 1M --output bench_1M.json
+#     event-impact serve --port 8080                 JSON query service for the dashboard
+#
+# --timing (or the EVENT_IMPACT_TIMING environment variable) prints wall time and peak memory per stage.
+
+import argparse
+import datetime
+import sys
+
+from . import timing
+from .locations import asset_path, crosswalk_path, cube_path, geo_columns, rate_columns, store_path
+
+
+def parseDate(x):
+    return datetime.date.fromisoformat(x)
+
+
+def parseList(x):
+    return [entry for entry in x.split(',') if entry]
+
+
+def ingestCommand(args):
+    from .call_cube import buildStoredCube, saveCube
+    from .call_store import ingestExport
+
+    stored = ingestExport(args.csv, args.store, args.memory_budget * 2**20)
+    saveCube(buildStoredCube(args.store), args.cube)
+    print('Stored ' + str(stored) + ' calls in ' + args.store + ' and built ' + args.cube)
+
+
+def updateCommand(args):
+    from .call_cube import updateCube
+    from .call_store import ingestNewCalls
+
+    new_calls = ingestNewCalls(args.export, args.store, args.memory_budget * 2**20)
+    updateCube(new_calls, args.cube)
+    print('Appended ' + str(len(new_calls)) + ' new calls')
+
+
+def reportCommand(args):
+    from .report import zScoreReport
+
+    geo_column = args.level.capitalize()
+    if args.crosswalk and geo_column != "Beat":
+        sys.exit('event-impact report: --crosswalk re-projects beats; it only applies to --level beat')
+    if args.crosswalk and args.significance:
+        # The significance tests run on the cube's own beats and would report a different change for the event
+        sys.exit('event-impact report: --significance works on the unprojected beats; drop --crosswalk, or compare by sector or precinct')
+    reprojected = None
+    if args.crosswalk:
+        from .beat_crosswalk import crosswalkWindowCounts
+        from .call_cube import sharedCube
+        from .call_rates import percentChange
+
+        percentages = percentChange(crosswalkWindowCounts(sharedCube(args.cube), args.date, args.window,
+                                                          asset_dir = args.assets, path = args.crosswalk_cache))
+        reprojected = (percentages["beat"].tolist(), percentages[rate_columns].to_numpy())
+    for line in zScoreReport(args.cube, args.date, args.location, args.window, geo_column, args.source, reprojected):
+        print(line)
+    if args.significance:
+        from .call_cube import sharedCube
+        from .call_stats import eventSignificance
+
+        significance = eventSignificance(sharedCube(args.cube), args.date, args.location, args.window,
+                                         geo_columns[geo_column], geo_column, seed = args.seed)
+        print(significance.table.to_string())
+        print('p_placebo_dates from ' + str(significance.placebo_dates) + ' distinct placebo event dates')
+
+
+def batchCommand(args):
+    from .call_cube import sharedCube
+    from .event_batch import queryGrid, randomQueries, runQueries, spreadByWindow
+
+    cube = sharedCube(args.cube)
+    geo_column = args.level.capitalize()
+    windows = [int(window) for window in parseList(args.windows)]
+    if args.random:
+        queries = randomQueries(cube, args.random, windows, geo_columns[geo_column], seed = args.seed)
+    elif args.dates:
+        locations = parseList(args.locations) if args.locations else geo_columns[geo_column]
+        queries = queryGrid([parseDate(date) for date in parseList(args.dates)], locations, windows)
+    else:
+        sys.exit('event-impact batch: give either --random or --dates')
+    # Worker processes memory-map the saved cube themselves
+    results = runQueries(queries, cube if args.processes == 1 else None, args.cube, geo_columns[geo_column], geo_column,
+                         processes = args.processes)
+    if args.output:
+        results.to_csv(args.output, index = False)
+    else:
+        print(spreadByWindow(results).to_string())
+
+
+def assetsCommand(args):
+    from .beat_assets import buildAssets
+
+    buildAssets(args.shapefiles, args.assets)
+
+
+def mapsCommand(args):
+    import pandas as pd
+
+    from .call_cube import sharedCube
+    from .call_maps import eventMapJobs, renderMaps
+
+    windows = [int(window) for window in parseList(args.windows)]
+    events = pd.MultiIndex.from_product([pd.to_datetime(parseList(args.dates)), windows], names = ["event_date", "window"]).to_frame(index = False)
+    jobs = eventMapJobs(sharedCube(args.cube), events, parseList(args.sources))
+    files = renderMaps(jobs, args.output, zoom = args.zoom, processes = args.processes, asset_dir = args.assets)
+    print('Wrote ' + str(len(files)) + ' maps to ' + args.output)
+
+
+def plotCommand(args):
+    import matplotlib
+    matplotlib.use('Agg')
+
+    from .call_cube import sharedCube, windowCounts
+    from .call_plots import percentageBoxplot
+    from .call_rates import percentChange
+
+    geo_column = args.level.capitalize()
+    percentages = percentChange(windowCounts(sharedCube(args.cube), args.date, args.window, geo_columns[geo_column], geo_column))
+    percentageBoxplot(percentages, args.location, args.date, args.window).savefig(args.output)
+
+
+def syntheticCommand(args):
+    from .synthetic import parseSize, writeSynthetic
+
+    rows = parseSize(args.rows)
+    writeSynthetic(args.output, rows, args.start, args.end, args.seed)
+    print('Wrote ' + str(rows) + ' synthetic calls to ' + args.output)
+
+
+def benchmarkCommand(args):
+    import json
+
+    from .benchmark import benchmarkRows, compareResults, resultLines, runBenchmark, saveResults
+    from .synthetic import parseSize
+
+    options = {"events": args.events, "queries": args.queries, "maps": args.maps, "asset_dir": args.assets,
+               "budget": args.memory_budget * 2**20}
+    if args.csv:
+        results = runBenchmark(args.csv, args.work_dir, seed = args.seed, **options)
+    else:
+        results = benchmarkRows(parseSize(args.rows), args.work_dir, seed = args.seed, **options)
+    print('\n'.join(resultLines(results)))
+    if args.output:
+        saveResults(results, args.output)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compareResults(results, json.load(baseline_file))
+        for regression in regressions:
+            print('REGRESSION: ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+def serveCommand(args):
+    from .service import serve
+
+    serve(args.cube, args.host, args.port, args.cache_mb * 2**20, args.assets)
+
+
+def buildParser():
+    parser = argparse.ArgumentParser(prog = 'event-impact', description = 'Before/after impact of events on SPD 911 calls.')
+    parser.add_argument('--store', default = store_path, help = 'call store directory')
+    parser.add_argument('--cube', default = cube_path, help = 'count cube directory')
+    parser.add_argument('--assets', default = asset_path, help = 'beat asset directory')
+    parser.add_argument('--memory-budget', type = int, default = 512, help = 'MB of memory for reading an export in chunks')
+    parser.add_argument('--timing', action = 'store_true', help = 'print wall time and peak memory per stage')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    ingest = commands.add_parser('ingest', help = 'load a full SPD export into the store and build the count cube')
+    ingest.add_argument('csv')
+    ingest.set_defaults(handler = ingestCommand)
+
+    update = commands.add_parser('update', help = 'append calls newer than the store from an export and update the cube')
+    update.add_argument('export')
+    update.set_defaults(handler = updateCommand)
+
+    # Options shared by everything that looks at one event
+    event = argparse.ArgumentParser(add_help = False)
+    event.add_argument('--date', type = parseDate, required = True, help = 'event date, YYYY-MM-DD')
+    event.add_argument('--location', required = True, help = 'event location (beat, sector or precinct)')
+    event.add_argument('--window', type = int, default = 90, help = 'days before and after the event')
+    event.add_argument('--level', default = 'beat', choices = ['beat', 'sector', 'precinct'])
+
+    report = commands.add_parser('report', parents = [event], help = 'z-score report for one event (text only)')
+    report.add_argument('--source', default = 'external', choices = rate_columns, help = 'call source to test')
+    report.add_argument('--crosswalk', action = 'store_true', help = 're-project beats across beat changes')
+    report.add_argument('--crosswalk-cache', default = crosswalk_path, help = 'crosswalk cache directory')
+    report.add_argument('--significance', action = 'store_true', help = 'add permutation p-values and bootstrap intervals')
+    report.add_argument('--seed', type = int, help = 'random seed for the resampling')
+    report.set_defaults(handler = reportCommand)
+
+    batch = commands.add_parser('batch', help = 'run many event queries against the cube')
+    batch.add_argument('--random', type = int, help = 'number of random queries to run')
+    batch.add_argument('--dates', help = 'comma-separated event dates (YYYY-MM-DD) for a grid')
+    batch.add_argument('--locations', help = 'comma-separated locations for a grid (default: every location)')
+    batch.add_argument('--windows', default = '90', help = 'comma-separated window sizes in days')
+    batch.add_argument('--level', default = 'beat', choices = ['beat', 'sector', 'precinct'])
+    batch.add_argument('--seed', type = int, help = 'random seed')
+    batch.add_argument('--processes', type = int, default = 1, help = 'worker processes')
+    batch.add_argument('--output', help = 'CSV to write the results to (default: print the spread by window)')
+    batch.set_defaults(handler = batchCommand)
+
+    assets = commands.add_parser('assets', help = 'build the beat geometry assets from the shapefiles')
+    assets.add_argument('--shapefiles', default = '.', help = 'directory holding the SPD beat shapefiles')
+    assets.set_defaults(handler = assetsCommand)
+
+    maps = commands.add_parser('maps', help = 'render choropleth maps for events')
+    maps.add_argument('--dates', required = True, help = 'comma-separated event dates (YYYY-MM-DD)')
+    maps.add_argument('--windows', default = '90', help = 'comma-separated window sizes in days')
+    maps.add_argument('--sources', default = 'external', help = 'comma-separated call sources to map')
+    maps.add_argument('--zoom', type = int, default = 11, help = 'initial zoom level (picks the geometry resolution)')
+    maps.add_argument('--processes', type = int, help = 'worker processes (default: one per CPU)')
+    maps.add_argument('--output', default = 'maps', help = 'directory to write the maps to')
+    maps.set_defaults(handler = mapsCommand)
+
+    plot = commands.add_parser('plot', parents = [event], help = 'boxplot of percentage change with the location marked')
+    plot.add_argument('--output', default = 'boxplot.png', help = 'image file to write')
+    plot.set_defaults(handler = plotCommand)
+
+    synthetic = commands.add_parser('synthetic', help = 'write a synthetic export in the Call_Data.csv schema')
+    synthetic.add_argument('--rows', default = '1M', help = 'number of calls: 1M, 10M, 50M or any count')
+    synthetic.add_argument('--start', default = '2009-01-01', help = 'first day of calls')
+    synthetic.add_argument('--end', help = 'last day of calls (default: end of last year)')
+    synthetic.add_argument('--seed', type = int, default = 0, help = 'random seed')
+    synthetic.add_argument('--output', default = 'synthetic_calls.csv', help = 'CSV to write')
+    synthetic.set_defaults(handler = syntheticCommand)
+
+    benchmark = commands.add_parser('benchmark', help = 'time each stage of the pipeline on a real or synthetic export')
+    benchmark.add_argument('--rows', default = '1M', help = 'size of the synthetic export: 1M, 10M, 50M or any count')
+    benchmark.add_argument('--csv', help = 'benchmark this export instead of a synthetic one')
+    benchmark.add_argument('--work-dir', default = 'benchmark', help = 'directory for the export, store, cube and maps')
+    benchmark.add_argument('--events', type = int, default = 20, help = 'events to filter and aggregate')
+    benchmark.add_argument('--queries', type = int, default = 10000, help = 'queries in the batch sweep')
+    benchmark.add_argument('--maps', type = int, default = 3, help = 'maps to render (needs beat assets)')
+    benchmark.add_argument('--seed', type = int, default = 0, help = 'random seed')
+    benchmark.add_argument('--output', help = 'JSON to save the results to')
+    benchmark.add_argument('--baseline', help = 'JSON from an earlier run; exit 1 if any stage regressed')
+    benchmark.set_defaults(handler = benchmarkCommand)
+
+    service = commands.add_parser('serve', help = 'answer impact queries as JSON over HTTP, with the cube held in memory')
+    service.add_argument('--host', default = '127.0.0.1', help = 'address to listen on')
+    service.add_argument('--port', type = int, default = 8080, help = 'port to listen on')
+    service.add_argument('--cache-mb', type = int, default = 64, help = 'MB of answers to keep in the LRU cache')
+    service.set_defaults(handler = serveCommand)
+    return parser
+
+
+def main(argv = None):
+    args = buildParser().parse_args(argv)
+    if args.timing:
+        timing.enable()
+    try:
+        args.handler(args)
+    except ValueError as error:
+        # Bad dates, locations and windows are the user's to fix; a traceback doesn't help with that
+        sys.exit('event-impact: ' + str(error))
+    if timing.enabled:
+        timing.printReport()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# Running many event queries at once against the count cube.
+#
+# The closing notes want to run "a bunch of random dates" to see where the standard deviation curve bends as
+# the window grows, and whether External calls vary less than Internal ones. Instead of re-running cells by hand
+# for each (event_date, event_location, window), a whole table of queries is evaluated together: the before and
+# after counts for every query come from fancy-indexing the cube's cumulative sums, so a chunk of queries costs
+# a few array operations. Chunks can also be spread over a process pool; each worker memory-maps the same cube.
+#
+# From the command line: event-impact batch --random 10000 --windows 30,60,90,180,365 --output sweep.csv
+
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .call_cube import rollupMatrix, sharedCube
+from .call_rates import beat, geoColumn, positionCodes, rate_columns
+from .locations import cube_path
+from .timing import timed
+
+chunk_size = 1000
+
+
+def queryGrid(event_dates, event_locations, windows):
+    # Every combination of the given dates, locations and window sizes
+    grid = pd.MultiIndex.from_product([pd.to_datetime(list(event_dates)), list(event_locations), list(windows)],
+                                      names = ["event_date", "event_location", "window"])
+    return grid.to_frame(index = False)
+
+
+def randomQueries(cube, count, windows, geo_flag = beat, seed = None):
+    # Random event dates (far enough from either end of the cube for the window to fit), locations and windows
+    rng = np.random.default_rng(seed)
+    windows = rng.choice(list(windows), count)
+    days = cube.cumulative.shape[0] - 1
+    offsets = rng.integers(windows, np.maximum(days - windows, windows + 1))
+    return pd.DataFrame({"event_date": cube.first_day + pd.to_timedelta(offsets, unit = 'D'),
+                         "event_location": rng.choice(list(geo_flag), count),
+                         "window": windows})
+
+
+def rollupCumulative(cube, geo_flag, geo_column):
+    # The cube's cumulative sums rolled up to geo_flag once, days + 1 x locations x (total + each call source).
+    # Done in float64 so the roll-up is a single BLAS matrix multiply; the counts stay exact far beyond anything
+    # the call history will reach.
+    membership = rollupMatrix(cube, geo_flag, geo_column).astype(np.float64)
+    rolled = np.matmul(np.asarray(cube.cumulative, dtype = np.float64).transpose(0, 2, 1), membership).transpose(0, 2, 1)
+    return np.concatenate([rolled.sum(axis = 2, keepdims = True), rolled], axis = 2)
+
+
+def windowChanges(rolled, event_index, window):
+    # Percentage changes, queries x locations x (total + each call source), for events on the given day indices
+    # of a rolled-up cube. Same window as the notebook: days strictly between event_date -/+ window, split at
+    # event_date.
+    days = rolled.shape[0] - 1
+    start_index = np.clip(event_index - window + 1, 0, days)
+    end_index = np.clip(event_index + window, 0, days)
+    event_index = np.clip(event_index, 0, days)
+    before = rolled[event_index] - rolled[start_index]
+    after = rolled[end_index] - rolled[event_index]
+    return (after - before) / np.maximum(before, 1) * 100
+
+
+def chunkResults(cube, rolled, queries, geo_flag):
+    # Percentage change, z-score and spread across locations for each query in one chunk
+    event_index = ((queries["event_date"] - cube.first_day) // pd.Timedelta(days = 1)).to_numpy()
+    changes = windowChanges(rolled, event_index, queries["window"].to_numpy())
+
+    location_index = positionCodes(queries["event_location"], geo_flag)
+    if (location_index < 0).any():
+        raise ValueError('event_location not in geo_flag: ' + str(queries["event_location"][location_index < 0].iloc[0]))
+    own = changes[np.arange(len(queries)), location_index, :]
+    # Population standard deviation, as in the notebook's significance check
+    spread = changes.std(axis = 1, ddof = 0)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        z = (own - changes.mean(axis = 1)) / spread
+
+    results = queries.reset_index(drop = True).copy()
+    source_order = ["total"] + [source.lower() for source in cube.sources]
+    for name in rate_columns:
+        position = source_order.index(name)
+        results[name] = own[:, position]
+        results[name + "_z"] = z[:, position]
+        results[name + "_std"] = spread[:, position]
+    return results
+
+
+@functools.lru_cache(maxsize = 4)
+def sharedRollup(path, geo_flag, geo_column):
+    # The saved cube at path and its roll-up to geo_flag (a tuple, so it can be a cache key), once per process
+    cube = sharedCube(path)
+    return cube, rollupCumulative(cube, list(geo_flag), geo_column)
+
+
+def runChunk(path, queries, geo_flag, geo_column):
+    # Process pool entry point; each worker memory-maps the cube and rolls it up on its first chunk only, rather
+    # than receiving a copy or redoing the roll-up for every chunk
+    cube, rolled = sharedRollup(path, tuple(geo_flag), geo_column)
+    return chunkResults(cube, rolled, queries, geo_flag)
+
+
+@timed('batch queries')
+def runQueries(queries, cube = None, path = cube_path, geo_flag = beat, geo_column = None, processes = 1):
+    # Tidy results table, one row per query: the query columns plus, for total, internal, external and other,
+    # the location's percentage change, its z-score against all locations, and the spread (std) across locations.
+    # With more than one process the workers open the saved cube at path themselves, so an in-memory cube can
+    # only be used with processes = 1.
+    if cube is not None and processes != 1:
+        raise ValueError('runQueries: the workers read the cube saved at path; pass cube = None when processes > 1')
+    if geo_column is None:
+        geo_column = geoColumn(geo_flag)
+    queries = queries.copy()
+    queries["event_date"] = pd.to_datetime(queries["event_date"])
+    chunks = [queries.iloc[i:i + chunk_size] for i in range(0, len(queries), chunk_size)] or [queries]
+    if processes == 1 or len(chunks) == 1:
+        if cube is None:
+            cube = sharedCube(path)
+        rolled = rollupCumulative(cube, geo_flag, geo_column)
+        results = [chunkResults(cube, rolled, chunk, geo_flag) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers = processes) as pool:
+            results = list(pool.map(runChunk, [path] * len(chunks), chunks, [geo_flag] * len(chunks), [geo_column] * len(chunks)))
+    return pd.concat(results, ignore_index = True)
+
+
+def spreadByWindow(results):
+    # Average spread across locations for each window size, to look for the bend in the curve; one column per
+    # call source so External and Internal can be compared directly
+    return results.groupby("window")[[name + "_std" for name in rate_columns]].mean()
@@ -0,0 +1,17 @@
+# The locations and call sources every analysis is broken down by, and the default directories for the store,
+# cube and beat files. Kept free of pandas and NumPy so the command line can use them without paying for those
+# imports.
+
+store_path = 'call_store'
+cube_path = 'call_cube'
+asset_path = 'beat_assets'
+crosswalk_path = 'beat_crosswalk'
+
+precinct = ["EAST", "NORTH", "SOUTH", "SOUTHWEST", "WEST", "UNKNOWN"]
+sector = ["B", "C", "D", "E", "F", "G", "J", "K", "L", "M", "N", "O", "Q", "R", "S", "U", "W"]
+beat = ["B1", "B2", "B3", "C1", "C2", "C3", "D1", "D2", "D3", "E1", "E2", "E3", "F1", "F2", "F3", "G1", "G2", "G3", "J1", "J2", "J3", "K1", "K2", "K3", "L1", "L2", "L3", "M1", "M2", "M3", "N1", "N2", "N3", "O1", "O2", "O3", "Q1", "Q2", "Q3", "R1", "R2", "R3", "S1", "S2", "S3", "U1", "U2", "U3", "W1", "W2", "W3"]
+# Column holding each geo_flag level in the call data
+geo_columns = {"Precinct": precinct, "Sector": sector, "Beat": beat}
+call_sources = ["Internal", "External", "Other"]
+# Output names, in order; "total" counts every call in the location whatever its source
+rate_columns = ["total", "internal", "external", "other"]
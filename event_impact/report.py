@@ -0,0 +1,87 @@
+# The text z-score report for one event, straight off the saved count cube.
+#
+# This is what gets run most often from the command line, so it sticks to NumPy and the standard library: the
+# cube's .npy and JSON index are read directly rather than through call_cube (which brings in pandas), and
+# nothing from the geo or plotting stack is ever touched.
+
+import datetime
+import functools
+import json
+import os
+
+import numpy as np
+
+from .beat_assets import beat_changes
+from .locations import geo_columns, rate_columns
+from .timing import timed
+
+
+@functools.lru_cache(maxsize = None)
+def cubeArrays(path):
+    # (memory-mapped cumulative counts, first day, location triples, sources), once per process
+    with open(os.path.join(path, 'index.json')) as index_file:
+        index = json.load(index_file)
+    cumulative = np.load(os.path.join(path, 'cumulative.npy'), mmap_mode = 'r')
+    return cumulative, datetime.date.fromisoformat(index["first_day"]), index["locations"], index["sources"]
+
+
+def locationChanges(path, event_date, window, geo_column = "Beat"):
+    # Percentage change, locations x (total + each call source), for the notebook's window around event_date
+    cumulative, first_day, locations, sources = cubeArrays(path)
+    geo_flag = geo_columns[geo_column]
+    position = {location: index for index, location in enumerate(geo_flag)}
+    level = ["Precinct", "Sector", "Beat"].index(geo_column)
+    membership = np.zeros((len(locations), len(geo_flag)))
+    for index, location in enumerate(locations):
+        if location[level] in position:
+            membership[index, position[location[level]]] = 1
+
+    days = cumulative.shape[0] - 1
+    event_index = (event_date - first_day).days
+    start, middle, end = [min(max(day, 0), days) for day in (event_index - window + 1, event_index, event_index + window)]
+    before = membership.T @ (np.asarray(cumulative[middle]) - np.asarray(cumulative[start]))
+    after = membership.T @ (np.asarray(cumulative[end]) - np.asarray(cumulative[middle]))
+    before = np.column_stack([before.sum(axis = 1), before])
+    after = np.column_stack([after.sum(axis = 1), after])
+    changes = (after - before) / np.maximum(before, 1) * 100
+    # Columns in rate_columns order
+    order = ["total"] + [source.lower() for source in sources]
+    return geo_flag, changes[:, [order.index(name) for name in rate_columns]]
+
+
+@timed('z-score report')
+def zScoreReport(path, event_date, event_location, window = 90, geo_column = "Beat", call_source = "external", reprojected = None):
+    # The notebook's warnings and significance check as lines of text. reprojected is an optional
+    # (beats, changes) pair already re-projected across beat changes (see beat_crosswalk), used instead of the cube.
+    lines = []
+    if geo_column == "Beat":
+        for entry in beat_changes:
+            if abs(event_date - entry) < datetime.timedelta(days = window):
+                if reprojected is None:
+                    lines.append("CAUTION: Beats have changed during the window used; proceed with caution, compare by "
+                                 "sector/precinct, or re-run with --crosswalk")
+                else:
+                    lines.append("Beats have changed during the window used; counts are re-projected onto the current beats")
+                break
+    cumulative, first_day = cubeArrays(path)[:2]
+    event_index = (event_date - first_day).days
+    if event_index - window + 1 >= cumulative.shape[0] - 1 or event_index + window <= 0:
+        raise ValueError('the window around ' + event_date.isoformat() + ' falls outside the call data')
+    if event_date - datetime.timedelta(days = window) < first_day:
+        lines.append("First entry in call_data is " + first_day.strftime('%d %B %Y') + "; adjust window or choose another event date.")
+
+    geo_flag, changes = reprojected if reprojected is not None else locationChanges(path, event_date, window, geo_column)
+    if event_location not in geo_flag:
+        raise ValueError('event_location not in ' + geo_column.lower() + ': ' + str(event_location))
+    column = changes[:, rate_columns.index(call_source)]
+    change = column[geo_flag.index(event_location)]
+    # Because this is a population standard deviation, the degrees of freedom is equal to the number of datapoints, not n-1
+    distance = (change - column.mean()) / column.std(ddof = 0)
+    direction = 'decreased' if distance < 0 else 'increased'
+    lines.append('The change in ' + call_source + ' calls for ' + event_location + ' is ' + str(round(change, 2)) + '%, or '
+                 + str(round(distance, 2)) + ' standard deviations from the mean.')
+    if abs(distance) <= 2.0:
+        lines.append('The event is unlikely to have significantly impacted calls to the police.')
+    else:
+        lines.append('The event may have significantly ' + direction + ' calls to the police.')
+    return lines
@@ -0,0 +1,304 @@
+# A long-running local query service for the dashboard.
+#
+# Every analyst question used to pay for loading, parsing and filtering the call data again. The service loads
+# the count cube once and keeps its daily cumulative counts rolled up to precincts, sectors and beats in memory,
+# so the before and after counts for any event_date, window and location are a few array subtractions. Answers
+# come back as JSON - the notebook's percentages table, the event location's z-scores and, on request, the map -
+# and are kept in an LRU cache bounded by the total size of the cached answers. The cube is checked for changes
+# on each request (a nightly `event-impact update` rewrites it), and the index and cache are rebuilt when it
+# changes.
+#
+#     event-impact serve --port 8080
+#     GET /impact?date=2015-04-05&location=B2&window=90&level=beat&map=1
+#     GET /health    GET /cache
+#
+# Standard library asyncio and a minimal HTTP/1.1 reader: GET only, keep-alive, no TLS. It is meant to sit on
+# localhost behind the dashboard, not on the open network.
+
+import asyncio
+import datetime
+import json
+import os
+import tempfile
+import time
+import urllib.parse
+from collections import OrderedDict
+
+import numpy as np
+
+from .beat_assets import beat_changes
+from .call_cube import loadCube
+from .event_batch import rollupCumulative, windowChanges
+from .locations import asset_path, cube_path, geo_columns, rate_columns
+
+host = '127.0.0.1'
+port = 8080
+cache_bytes = 64 * 2**20
+# Anything bigger than this in a request line or header is not from the dashboard
+line_limit = 8192
+statuses = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error',
+            501: 'Not Implemented'}
+
+
+class ResultCache:
+    # Least recently used answers, evicted oldest first once the encoded answers add up to more than max_bytes.
+    # An answer bigger than max_bytes on its own is never cached.
+    def __init__(self, max_bytes = cache_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        body = self.entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        while self.entries and self.size + len(body) > self.max_bytes:
+            self.size -= len(self.entries.popitem(last = False)[1])
+        self.entries[key] = body
+        self.size += len(body)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.size, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses}
+
+
+def jsonNumber(x, digits = 4):
+    # JSON has no NaN or infinity; those (e.g. a z-score when every location changed by the same amount) become null
+    x = float(x)
+    return round(x, digits) if np.isfinite(x) else None
+
+
+class ImpactIndex:
+    # The cube rolled up once per level, with the day range; everything a query needs, held in memory
+    def __init__(self, path = cube_path):
+        self.path = path
+        self.stamp = self.cubeStamp()
+        cube = loadCube(path, mmap = False)
+        self.first_day = cube.first_day.date()
+        self.days = cube.cumulative.shape[0] - 1
+        self.rolled = {level: rollupCumulative(cube, geo_flag, level) for level, geo_flag in geo_columns.items()}
+        source_order = ["total"] + [source.lower() for source in cube.sources]
+        self.order = [source_order.index(name) for name in rate_columns]
+
+    def cubeStamp(self):
+        stat = os.stat(os.path.join(self.path, 'cumulative.npy'))
+        return stat.st_mtime_ns, stat.st_size
+
+    def changed(self):
+        return self.cubeStamp() != self.stamp
+
+    def impact(self, event_date, event_location, window, level = "Beat"):
+        # The answer to one query as a dict ready for JSON; ValueError for anything the query gets wrong
+        if level not in geo_columns:
+            raise ValueError('level must be one of ' + ', '.join(name.lower() for name in geo_columns))
+        geo_flag = geo_columns[level]
+        if event_location not in geo_flag:
+            raise ValueError('location not in ' + level.lower() + ': ' + event_location)
+        if window < 2:
+            raise ValueError('window must be at least 2 days')
+        event_index = (event_date - self.first_day).days
+        if event_index - window + 1 >= self.days or event_index + window <= 0:
+            raise ValueError('the window around ' + event_date.isoformat() + ' falls outside the call data')
+
+        warnings = []
+        if level == "Beat" and any(abs((event_date - entry).days) < window for entry in beat_changes):
+            warnings.append("Beats have changed during the window used; proceed with caution or compare by sector/precinct")
+        if event_index - window < 0:
+            warnings.append("First entry in call_data is " + self.first_day.strftime('%d %B %Y') + "; adjust window or choose another event date.")
+
+        changes = windowChanges(self.rolled[level], np.array([event_index]), window)[0][:, self.order]
+        mean = changes.mean(axis = 0)
+        # Population standard deviation, as in the notebook's significance check
+        spread = changes.std(axis = 0, ddof = 0)
+        own = changes[geo_flag.index(event_location)]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            z = (own - mean) / spread
+        key = level.lower()
+        return {"event_date": event_date.isoformat(), "event_location": event_location, "window": window, "level": key,
+                "warnings": warnings,
+                "percentages": [dict([(key, location)] + [(name, jsonNumber(value)) for name, value in zip(rate_columns, row)])
+                                for location, row in zip(geo_flag, changes)],
+                "change": {name: jsonNumber(value) for name, value in zip(rate_columns, own)},
+                "z": {name: jsonNumber(value) for name, value in zip(rate_columns, z)},
+                "mean": {name: jsonNumber(value) for name, value in zip(rate_columns, mean)},
+                "std": {name: jsonNumber(value) for name, value in zip(rate_columns, spread)},
+                # The notebook's verdict: more than two standard deviations from the mean
+                "significant": {name: bool(np.isfinite(value) and abs(value) > 2.0) for name, value in zip(rate_columns, z)}}
+
+
+class ImpactService:
+    def __init__(self, path = cube_path, max_bytes = cache_bytes, asset_dir = asset_path):
+        self.index = ImpactIndex(path)
+        self.cache = ResultCache(max_bytes)
+        self.asset_dir = asset_dir
+        # Shared beat geometry for maps, written on the first map request and served from memory
+        self.geometry = {}
+        self.started = time.time()
+
+    def refresh(self):
+        # A rewritten cube means new data: rebuild the index and drop every cached answer
+        if self.index.changed():
+            self.index = ImpactIndex(self.index.path)
+            self.cache.clear()
+
+    def mapGeometry(self):
+        from .call_maps import writeSharedGeometry
+
+        if not self.geometry:
+            with tempfile.TemporaryDirectory() as out_dir:
+                name = writeSharedGeometry(out_dir, asset_dir = self.asset_dir)
+                with open(os.path.join(out_dir, name), 'rb') as script:
+                    self.geometry[name] = script.read()
+        return next(iter(self.geometry))
+
+    def mapHtml(self, answer, call_source):
+        # Rendering runs in a worker thread, since it takes far longer than the counts
+        import pandas as pd
+
+        from .call_maps import mapHtml
+
+        percentages = pd.DataFrame(answer["percentages"])
+        job = {"percentages": percentages, "call_source": call_source,
+               "title": 'Change in ' + call_source + ' calls for ' + str(answer["window"]) + ' days after versus before '
+                        + answer["event_date"] + ' (percentage)'}
+        return mapHtml(job, '/static/' + self.mapGeometry())
+
+    async def impact(self, query):
+        event_date = parseDate(query.get("date"))
+        event_location = query.get("location", "")
+        window = int(query.get("window", 90))
+        level = query.get("level", "beat").capitalize()
+        call_source = query.get("map_source", "external")
+        with_map = query.get("map", "0") not in ("", "0", "false", "no")
+        if with_map and level != "Beat":
+            raise ValueError('maps are by beat; use level=beat')
+        if with_map and call_source not in rate_columns:
+            raise ValueError('map_source must be one of ' + ', '.join(rate_columns))
+
+        key = (event_date, event_location, window, level, call_source if with_map else None)
+        body = self.cache.get(key)
+        if body is None:
+            answer = self.index.impact(event_date, event_location, window, level)
+            if with_map:
+                answer["map"] = await asyncio.get_running_loop().run_in_executor(None, self.mapHtml, answer, call_source)
+            body = json.dumps(answer).encode()
+            self.cache.put(key, body)
+        return body
+
+    async def respond(self, method, target):
+        # (status, content type, body) for one request
+        if method not in ('GET', 'HEAD'):
+            return 405, 'application/json', errorBody('only GET is supported')
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        self.refresh()
+        if url.path == '/impact':
+            return 200, 'application/json', await self.impact(query)
+        if url.path == '/health':
+            return 200, 'application/json', json.dumps({"status": "ok", "first_day": self.index.first_day.isoformat(),
+                                                        "days": self.index.days, "uptime": round(time.time() - self.started, 1)}).encode()
+        if url.path == '/cache':
+            return 200, 'application/json', json.dumps(self.cache.stats()).encode()
+        if url.path.startswith('/static/') and url.path[len('/static/'):] in self.geometry:
+            return 200, 'application/javascript', self.geometry[url.path[len('/static/'):]]
+        return 404, 'application/json', errorBody('no such path: ' + url.path)
+
+    async def handle(self, reader, writer):
+        # One connection; requests are answered in order until the client closes it or asks to
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                if len(request_line) > line_limit:
+                    await self.send(writer, 400, 'application/json', errorBody('request line too long'), False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    if len(line) > line_limit or len(headers) > 100:
+                        headers = None
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                parts = request_line.decode('latin-1').split()
+                if headers is None or len(parts) != 3:
+                    await self.send(writer, 400, 'application/json', errorBody('malformed request'), False)
+                    break
+                method, target, version = parts
+                keep_alive = headers.get('connection', '').lower() != 'close' and version != 'HTTP/1.0'
+                try:
+                    status, content_type, body = await self.respond(method, target)
+                except ValueError as error:
+                    status, content_type, body = 400, 'application/json', errorBody(str(error))
+                except ImportError as error:
+                    status, content_type, body = 501, 'application/json', errorBody('maps need the maps extra: ' + str(error))
+                except Exception as error:
+                    status, content_type, body = 500, 'application/json', errorBody(type(error).__name__ + ': ' + str(error))
+                await self.send(writer, status, content_type, b'' if method == 'HEAD' else body, keep_alive, len(body))
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def send(self, writer, status, content_type, body, keep_alive, length = None):
+        head = ('HTTP/1.1 ' + str(status) + ' ' + statuses[status] + '\r\n'
+                'Content-Type: ' + content_type + '\r\n'
+                'Content-Length: ' + str(len(body) if length is None else length) + '\r\n'
+                'Connection: ' + ('keep-alive' if keep_alive else 'close') + '\r\n\r\n')
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+def parseDate(x):
+    if not x:
+        raise ValueError('date is required (YYYY-MM-DD)')
+    try:
+        return datetime.date.fromisoformat(x)
+    except ValueError:
+        raise ValueError('date must be YYYY-MM-DD: ' + x)
+
+
+def errorBody(message):
+    return json.dumps({"error": message}).encode()
+
+
+async def startService(path = cube_path, host = host, port = port, max_bytes = cache_bytes, asset_dir = asset_path):
+    # The running server (an asyncio.Server) and the service behind it
+    service = ImpactService(path, max_bytes, asset_dir)
+    server = await asyncio.start_server(service.handle, host, port)
+    return server, service
+
+
+def serve(path = cube_path, host = host, port = port, max_bytes = cache_bytes, asset_dir = asset_path):
+    # Serving until interrupted
+    async def run():
+        server, service = await startService(path, host, port, max_bytes, asset_dir)
+        print('Serving ' + path + ' on http://' + host + ':' + str(port))
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
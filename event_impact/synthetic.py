@@ -0,0 +1,183 @@
+# Synthetic call data in the Call_Data.csv schema, for benchmarking at sizes the real export doesn't come in.
+#
+# The same eleven columns, written the way SPD writes them: MM/DD/YYYY HH:MM:SS AM/PM times, "--"-prefixed
+# call types with the odd stray space or lower-case variant for the cleanup to deal with, Priority as a number,
+# and Precinct/Sector/Beat that agree with each other. Calls are spread from 2009 onwards with a slow upward
+# trend, a summer peak and a daily cycle, and the call type, priority and beat mixes are skewed the way the
+# real data is (a few beats and call types carry most of the calls), so category counts and window sizes
+# behave like the real thing. Rows are generated and written a chunk at a time, so 50M rows need no more
+# memory than one chunk.
+
+import datetime
+import functools
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv
+
+from .locations import beat
+
+# Standard sizes for benchmarking
+sizes = {"1M": 1000000, "10M": 10000000, "50M": 50000000}
+first_date = "2009-01-01"
+chunk_rows = 1000000
+
+export_columns = ["CAD Event Number", "Event Clearance Description", "Call Type", "Priority", "Initial Call Type",
+                  "Final Call Type", "Original Time Queued", "Arrived Time", "Precinct", "Sector", "Beat"]
+
+# Share of calls by Call Type, roughly as in the full export
+call_type_weights = {"911": 0.36, "TELEPHONE OTHER, NOT 911": 0.25, "ONVIEW": 0.23, "ALARM CALL (NOT POLICE ALARM)": 0.04,
+                     "PROACTIVE (OFFICER INITIATED)": 0.03, "HISTORY CALL (RETRO)": 0.025, "IN PERSON COMPLAINT": 0.02,
+                     "SCHEDULED EVENT (RECURRING)": 0.01, "FK ERROR": 0.01, "TEXT MESSAGE": 0.005, "POLICE (VARDA ALARM)": 0.01}
+priority_weights = {1: 0.08, 2: 0.22, 3: 0.30, 4: 0.12, 5: 0.04, 6: 0.03, 7: 0.13, 8: 0.05, 9: 0.03}
+# Initial and Final Call Types, most common first; the weights fall off like the real ones
+final_call_types = ["--DISTURBANCE - OTHER", "--SUSPICIOUS CIRCUM. - SUSPICIOUS PERSON", "--TRAFFIC - MV COLLISION INVESTIGATION",
+                    "--PROPERTY - THEFT", "--ASSAULTS - HARASSMENT, THREATS", "--ALARM-COMM (INC BANK, ATM, SCHOOL, BSN)",
+                    "--PREMISE CHECKS - REQUEST TO WATCH", "--CRISIS COMPLAINT - GENERAL", "--BURGLARY - RESIDENTIAL, UNOCCUPIED",
+                    "--AUTOMOBILES - AUTO THEFT", "--DV - ARGUMENTS, DISTURBANCE (NO ARREST)", "--WARRANT SERVICES - MISDEMEANOR",
+                    "--NARCOTICS - OTHER", "--ASSAULTS, OTHER", "--ROBBERY - STRONG ARM", "--TRESPASS", "--PARKING VIOLATION (EXCEPT ABANDONED CAR)",
+                    "--MISCHIEF OR NUISANCE - GENERAL", "--WEAPON - GUN, DEADLY WEAPON", "--PERSON - MISSING PERSON"]
+initial_call_types = ["DISTURBANCE, MISCHIEF", "SUSPICIOUS PERSON, VEHICLE OR INCIDENT", "MVC - WITH INJURIES", "THEFT (DOES NOT INCLUDE SHOPLIFT OR SVCS)",
+                      "THREATS (INCLS IN-PERSON/BY PHONE/IN WRITING)", "ALARM - COMM (INC BANK, ATM, SCHOOL, BSN)", "PREMISE CHECK, OFFICER INITIATED ONVIEW ONLY",
+                      "PERSON IN BEHAVIORAL/EMOTIONAL CRISIS", "BURG - RES (INCL UNOCC STRUCTURES ON PROP)", "AUTO RECOVERY",
+                      "DIST - DV - NO ASLT", "WARRANT - FELONY PICKUP", "NARCOTICS - VIOLATIONS (LOITER, USE, SELL, NARS)",
+                      "ASLT - WITH OR W/O WEAPONS (NO SHOOTINGS)", "ROBBERY (INCLUDES STRONG ARM)", "TRESPASS", "PARKING VIOLATION (EXCEPT ABANDONED CAR)",
+                      "NUISANCE - MISCHIEF", "WEAPN-GUN,DEADLY WPN (NO THRT/ASLT/DIST)", "MISSING - ADULT"]
+clearances = ["REPORT WRITTEN (NO ARREST)", "ASSISTANCE RENDERED", "UNABLE TO LOCATE INCIDENT OR COMPLAINANT",
+              "NO POLICE ACTION POSSIBLE OR NECESSARY", "PHYSICAL ARREST MADE", "ORAL WARNING GIVEN",
+              "CITATION ISSUED (CRIMINAL OR NON-CRIMINAL)", "OFFICER INITIATED ONVIEW INCIDENT", "RESPONDING UNIT(S) CANCELLED BY RADIO"]
+# Sector to precinct, as SPD has drawn them since 2015
+sector_precincts = {"B": "NORTH", "J": "NORTH", "L": "NORTH", "N": "NORTH", "U": "NORTH", "C": "EAST", "E": "EAST", "G": "EAST",
+                    "O": "SOUTH", "R": "SOUTH", "S": "SOUTH", "F": "SOUTHWEST", "W": "SOUTHWEST",
+                    "D": "WEST", "K": "WEST", "M": "WEST", "Q": "WEST"}
+# Calls by hour of the day, midnight first
+hour_weights = [4.0, 3.4, 3.0, 2.0, 1.5, 1.4, 1.8, 2.6, 3.4, 3.9, 4.2, 4.4, 4.6, 4.7, 4.9, 5.1, 5.3, 5.3, 5.1, 4.9, 4.7, 4.6, 4.4, 4.1]
+# Share of rows with no beat (precinct UNKNOWN), no arrival time, or a messy text value
+unknown_share = 0.01
+no_arrival_share = 0.05
+messy_share = 0.01
+
+
+def zipfWeights(count, exponent = 1.0):
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def dayCounts(rows, start, end, rng):
+    # Calls on each day from start to end: a gentle upward trend and a summer peak, drawn as one multinomial
+    days = pd.date_range(start, end, freq = 'D')
+    years = np.arange(len(days)) / 365.25
+    season = 1 + 0.15 * np.sin(2 * np.pi * (days.dayofyear.to_numpy() - 105) / 365.25)
+    weights = (1 + 0.03 * years) * season
+    return days, rng.multinomial(rows, weights / weights.sum())
+
+
+@functools.lru_cache(maxsize = None)
+def clockStrings():
+    # HH:MM:SS AM/PM for every second of the day
+    return pa.array(pd.to_datetime(np.arange(86400), unit = 's').strftime('%I:%M:%S %p'), type = pa.string())
+
+
+def formatTimes(seconds):
+    # SPD's MM/DD/YYYY HH:MM:SS AM/PM strings for seconds since the epoch. The date part is formatted once per
+    # distinct day and the time part looked up by second of the day, then the two are joined.
+    days, second_of_day = np.divmod(seconds, 86400)
+    unique_days, day_codes = np.unique(days, return_inverse = True)
+    day_strings = pa.array(pd.to_datetime(unique_days, unit = 'D').strftime('%m/%d/%Y'), type = pa.string())
+    return pc.binary_join_element_wise(day_strings.take(pa.array(day_codes)), clockStrings().take(pa.array(second_of_day)), ' ')
+
+
+def pick(labels, weights, count, rng):
+    return np.asarray(labels, dtype = object)[rng.choice(len(labels), size = count, p = weights)]
+
+
+def messUp(values, rng):
+    # A small share of values with the spacing and case noise the real text columns have
+    messy = np.flatnonzero(rng.random(len(values)) < messy_share)
+    values[messy] = [' ' + value.lower() + ' ' if index % 2 else value + '  ' for index, value in zip(messy, values[messy])]
+    return values
+
+
+def syntheticChunks(rows, start = first_date, end = None, seed = 0, chunk_size = chunk_rows):
+    # The synthetic export as dataframes of about chunk_size rows each, in time order. end defaults to the end of
+    # last year; the same rows and seed always give the same data.
+    if end is None:
+        end = datetime.date(datetime.date.today().year - 1, 12, 31)
+    rng = np.random.default_rng(seed)
+    days, per_day = dayCounts(rows, start, end, rng)
+    # Some beats are much busier than others; the order is shuffled so it isn't alphabetical
+    beat_weights = rng.permutation(zipfWeights(len(beat), 0.6))
+    call_types, call_type_shares = list(call_type_weights), np.array(list(call_type_weights.values()))
+    priorities, priority_shares = list(priority_weights), np.array(list(priority_weights.values()))
+    type_weights = zipfWeights(len(final_call_types))
+    clearance_weights = zipfWeights(len(clearances), 0.8)
+    day_seconds = ((days - pd.Timestamp(0)) // pd.Timedelta(seconds = 1)).to_numpy()
+    hour_shares = np.array(hour_weights) / sum(hour_weights)
+
+    event_number = int(pd.Timestamp(start).year) * 10**9
+    first_day = 0
+    while first_day < len(days):
+        # Whole days per chunk, so rows stay in time order across chunks
+        last_day = first_day + max(int(np.searchsorted(np.cumsum(per_day[first_day:]), chunk_size)), 1)
+        counts = per_day[first_day:last_day]
+        count = int(counts.sum())
+        seconds = np.repeat(day_seconds[first_day:last_day], counts)
+        seconds = seconds + rng.choice(24, size = count, p = hour_shares) * 3600 + rng.integers(0, 3600, size = count)
+        seconds.sort()
+        first_day = last_day
+        if count == 0:
+            continue
+
+        call_type = pick(call_types, call_type_shares / call_type_shares.sum(), count, rng)
+        # Onview and proactive calls have an officer there already; the rest take minutes to an hour
+        delay = np.where(np.isin(call_type, ["ONVIEW", "PROACTIVE (OFFICER INITIATED)"]), 0,
+                         rng.exponential(20 * 60, size = count).astype(np.int64))
+        arrived = formatTimes(seconds + delay).to_numpy(zero_copy_only = False).astype(object)
+        arrived[rng.random(count) < no_arrival_share] = None
+        final_type = rng.choice(len(final_call_types), size = count, p = type_weights)
+        # The call usually ends up typed the way it came in
+        initial_type = np.where(rng.random(count) < 0.8, final_type, rng.choice(len(initial_call_types), size = count, p = type_weights))
+        beats = pick(beat, beat_weights, count, rng)
+        sectors = np.array([entry[0] for entry in beats], dtype = object)
+        precincts = np.array([sector_precincts[entry] for entry in sectors], dtype = object)
+        unknown = rng.random(count) < unknown_share
+        beats[unknown], sectors[unknown], precincts[unknown] = None, None, "UNKNOWN"
+
+        yield pd.DataFrame({
+            "CAD Event Number": np.arange(event_number, event_number + count),
+            "Event Clearance Description": pick(clearances, clearance_weights, count, rng),
+            "Call Type": messUp(call_type, rng),
+            "Priority": pick(priorities, priority_shares / priority_shares.sum(), count, rng),
+            "Initial Call Type": np.asarray(initial_call_types, dtype = object)[initial_type],
+            "Final Call Type": messUp(np.asarray(final_call_types, dtype = object)[final_type], rng),
+            "Original Time Queued": formatTimes(seconds).to_numpy(zero_copy_only = False),
+            "Arrived Time": arrived,
+            "Precinct": precincts, "Sector": sectors, "Beat": beats}, columns = export_columns)
+        event_number += count
+
+
+def writeSynthetic(path, rows, start = first_date, end = None, seed = 0, chunk_size = chunk_rows):
+    # Writing a synthetic export of rows calls to path as CSV, a chunk at a time; returns path. Arrow's CSV writer
+    # is several times faster than to_csv, which matters at 50M rows.
+    writer = None
+    try:
+        for chunk in syntheticChunks(rows, start, end, seed, chunk_size):
+            table = pa.Table.from_pandas(chunk, preserve_index = False)
+            if writer is None:
+                writer = pyarrow.csv.CSVWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    return path
+
+
+def parseSize(x):
+    # "1M", "10M", "50M", "250k" or a plain number of rows
+    x = str(x).strip()
+    if x in sizes:
+        return sizes[x]
+    multiplier = {"k": 10**3, "K": 10**3, "m": 10**6, "M": 10**6}.get(x[-1:], 1)
+    return int(float(x[:-1] if multiplier > 1 else x) * multiplier)
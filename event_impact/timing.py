@@ -0,0 +1,111 @@
+# Wall time and peak memory per pipeline stage.
+#
+# The expensive steps (reading, date parsing, classification, store writes, cube builds, rate aggregation,
+# significance, map rendering) are wrapped in stage() blocks. Normally those blocks do nothing; set the
+# EVENT_IMPACT_TIMING environment variable or pass --timing on the command line and each stage adds up its
+# calls and wall time and notes the process's peak RSS when it finishes, and the totals are printed at the
+# end of the run. Standard library only, so the text report can be timed without importing anything heavy.
+#
+# Stages can nest (a cube build reads the store), so the seconds don't add up to the run time.
+#
+# Peak RSS is the process high-water mark, so it only ever goes up; "grew" is how much a stage raised it,
+# which is what points at the stage responsible for a memory regression.
+
+import contextlib
+import functools
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; stages are still timed
+    resource = None
+
+enabled = bool(os.environ.get('EVENT_IMPACT_TIMING'))
+# Stage name: [calls, seconds, peak RSS in MB at the end of the stage, MB the stage raised the peak by]
+stages = {}
+disabled_stage = contextlib.nullcontext()
+# End-of-iteration marker for timedIterator
+stopped = object()
+
+
+def enable(on = True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    stages.clear()
+
+
+def peakMemory():
+    # Peak resident set size of this process in MB (ru_maxrss is in kB on Linux, bytes on macOS)
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+@contextlib.contextmanager
+def timedStage(name):
+    peak_before = peakMemory()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        peak = peakMemory()
+        entry = stages.setdefault(name, [0, 0.0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], peak)
+        entry[3] += peak - peak_before
+
+
+def stage(name):
+    # with stage('date parsing'): ...
+    if not enabled:
+        return disabled_stage
+    return timedStage(name)
+
+
+def timed(name):
+    # Decorator form of stage, for functions that are a stage in their own right
+    def decorate(function):
+        @functools.wraps(function)
+        def timedFunction(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return timedFunction
+    return decorate
+
+
+def timedIterator(name, iterable):
+    # Iterating with the time spent producing each item (e.g. reading each chunk of a CSV) counted as name
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            item = next(iterator, stopped)
+        if item is stopped:
+            return
+        yield item
+
+
+def formatStages(entries):
+    # A table of (name, calls, seconds, peak MB, grew MB) entries
+    lines = ['{:<20} {:>7} {:>10} {:>10} {:>9}'.format('stage', 'calls', 'seconds', 'peak MB', 'grew MB')]
+    for name, calls, seconds, peak, grew in entries:
+        lines.append('{:<20} {:>7} {:>10.3f} {:>10.1f} {:>9.1f}'.format(name, calls, seconds, peak, grew))
+    return lines
+
+
+def report():
+    # One line per stage, in the order the stages first ran
+    return formatStages((name,) + tuple(values) for name, values in stages.items())
+
+
+def printReport(file = None):
+    if stages:
+        print('\n'.join(report()), file = file if file is not None else sys.stderr)
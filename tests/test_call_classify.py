@@ -0,0 +1,65 @@
+# Cleaning and classifying the call type columns, one distinct value at a time
+
+import numpy as np
+import pandas as pd
+
+from event_impact.call_classify import (callSource, callSources, crimeGroups, groupTable, loadGroups,
+                                        normalizeCategories, normalizeCategory)
+
+
+def testNormalizeCategory():
+    assert normalizeCategory("  assaults -  harassment ") == "ASSAULTS - HARASSMENT"
+    assert normalizeCategory("--ASSAULTS - HARASSMENT") == "ASSAULTS - HARASSMENT"
+    assert normalizeCategory("* .onview") == "ONVIEW"
+    assert normalizeCategory("Suspicious\tPerson\n") == "SUSPICIOUS PERSON"
+    # Only leading markers go; punctuation inside or at the end stays
+    assert normalizeCategory("TELEPHONE OTHER, not 911.") == "TELEPHONE OTHER, NOT 911."
+    for missing in [None, np.nan, "", "  ", "--*"]:
+        assert normalizeCategory(missing) is None
+
+
+def testNormalizeCategoriesCollapsesVariants():
+    normalized = normalizeCategories(pd.Series(["911", " onview", "ONVIEW", "--onview ", None], index = [3, 4, 5, 6, 7]))
+    assert normalized.tolist()[:4] == ["911", "ONVIEW", "ONVIEW", "ONVIEW"]
+    assert pd.isna(normalized[7])
+    assert normalized.index.tolist() == [3, 4, 5, 6, 7]
+    assert normalized.cat.categories.tolist() == ["911", "ONVIEW"]
+
+
+def testCallSources():
+    call_types = pd.Series(["911", "TELEPHONE OTHER, NOT 911", "telephone other, not 911", "ONVIEW",
+                            "PROACTIVE (OFFICER INITIATED)", "* text message", "SOMETHING NEW", None, np.nan])
+    expected = ["External", "External", "External", "Internal", "Internal", "External", "Other", "Other", "Other"]
+    sources = callSources(call_types)
+    assert sources.tolist() == expected
+    assert sources.cat.categories.tolist() == ["Internal", "External", "Other"]
+    # The per-value version agrees with the column version
+    assert [callSource(call_type) for call_type in call_types] == expected
+
+
+def testCallSourcesWithAnEditedTable():
+    sources = callSources(pd.Series(["911", "SOMETHING NEW"]), {"SOMETHING NEW": "Internal"})
+    assert sources.tolist() == ["Other", "Internal"]
+
+
+def testCrimeGroups():
+    call_types = pd.Series(["--ASSAULTS - HARASSMENT", "assaults - simple", "TRAFFIC - MV COLLISION", "NOISE", None])
+    groups = crimeGroups(call_types)
+    # Without an entry in the table, the heading before " - " is the group
+    assert groups.tolist()[:4] == ["ASSAULTS", "ASSAULTS", "TRAFFIC", "NOISE"]
+    assert pd.isna(groups.iloc[4])
+    edited = crimeGroups(call_types, {"ASSAULTS - HARASSMENT": "HARASSMENT"})
+    assert edited.tolist()[:4] == ["HARASSMENT", "ASSAULTS", "TRAFFIC", "NOISE"]
+
+
+def testGroupTableRoundTrip(tmp_path):
+    call_types = pd.Series(["--ASSAULTS - HARASSMENT", "assaults - harassment", "TRAFFIC - MV COLLISION", None])
+    table = groupTable(call_types)
+    assert table["call_type"].tolist() == ["ASSAULTS - HARASSMENT", "TRAFFIC - MV COLLISION"]
+    assert table["group"].tolist() == ["ASSAULTS", "TRAFFIC"]
+
+    table.loc[table["call_type"] == "TRAFFIC - MV COLLISION", "group"] = "COLLISIONS"
+    table.to_csv(tmp_path / 'groups.csv', index = False)
+    groups = loadGroups(tmp_path / 'groups.csv')
+    assert groups == {"ASSAULTS - HARASSMENT": "ASSAULTS", "TRAFFIC - MV COLLISION": "COLLISIONS"}
+    assert crimeGroups(call_types, groups).tolist()[:3] == ["ASSAULTS", "ASSAULTS", "COLLISIONS"]
@@ -0,0 +1,97 @@
+# Every way of getting the percentages table - counting a filtered window, the cube, the text report's direct
+# read of the cube and the batch queries - against the notebook's list comprehensions on the same calls
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from event_impact.call_cube import buildCube, saveCube, windowCounts
+from event_impact.call_rates import countBeforeAfter, percentChange
+from event_impact.call_store import prepareCalls
+from event_impact.event_batch import queryGrid, runQueries
+from event_impact.locations import geo_columns, rate_columns
+from event_impact.report import locationChanges
+from event_impact.synthetic import syntheticChunks
+
+levels = list(geo_columns)
+# Mid-data, and windows running off the start and the end of the calls
+events = [(pd.Timestamp('2015-04-05'), 90), (pd.Timestamp('2015-03-01'), 7), (pd.Timestamp('2015-01-20'), 30),
+          (pd.Timestamp('2015-06-20'), 30)]
+
+
+@pytest.fixture(scope = 'module')
+def calls():
+    export = pd.concat(syntheticChunks(8000, start = '2015-01-01', end = '2015-06-30', seed = 5), ignore_index = True)
+    return prepareCalls(export)
+
+
+@pytest.fixture(scope = 'module')
+def cube(calls):
+    return buildCube(calls)
+
+
+@pytest.fixture(scope = 'module')
+def cube_dir(cube, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('cube'))
+    saveCube(cube, path)
+    return path
+
+
+def withinWindow(calls, event_date, window):
+    # The notebook's within_window: days strictly between event_date - window and event_date + window
+    return calls.loc[(calls["Date Queued"] > event_date - pd.Timedelta(days = window))
+                     & (calls["Date Queued"] < event_date + pd.Timedelta(days = window))]
+
+
+def referencePercentages(calls, event_date, window, geo_column):
+    # The notebook's "Getting rates" cell, one list comprehension per call source and period
+    within_window = withinWindow(calls, event_date, window)
+    geo_flag = geo_columns[geo_column]
+    percentages = {geo_column.lower(): geo_flag}
+    for name in rate_columns:
+        source = within_window["Call Source"] == name.capitalize() if name != "total" else True
+        all_before = [sum((within_window["Date Queued"] < event_date) & (within_window[geo_column] == entry) & source) for entry in geo_flag]
+        all_after = [sum((within_window["Date Queued"] >= event_date) & (within_window[geo_column] == entry) & source) for entry in geo_flag]
+        percentages[name] = [(after - before) / max(before, 1) * 100 for before, after in zip(all_before, all_after)]
+    return pd.DataFrame(percentages)
+
+
+@pytest.mark.parametrize('event_date, window', events)
+@pytest.mark.parametrize('geo_column', levels)
+def testCountBeforeAfter(calls, event_date, window, geo_column):
+    counts = countBeforeAfter(withinWindow(calls, event_date, window), event_date, geo_columns[geo_column], geo_column)
+    pd.testing.assert_frame_equal(percentChange(counts), referencePercentages(calls, event_date, window, geo_column))
+
+
+@pytest.mark.parametrize('event_date, window', events)
+@pytest.mark.parametrize('geo_column', levels)
+def testWindowCounts(calls, cube, event_date, window, geo_column):
+    counts = windowCounts(cube, event_date, window, geo_columns[geo_column], geo_column)
+    pd.testing.assert_frame_equal(percentChange(counts), referencePercentages(calls, event_date, window, geo_column))
+
+
+@pytest.mark.parametrize('event_date, window', events)
+@pytest.mark.parametrize('geo_column', levels)
+def testLocationChanges(calls, cube_dir, event_date, window, geo_column):
+    geo_flag, changes = locationChanges(cube_dir, event_date.date(), window, geo_column)
+    expected = referencePercentages(calls, event_date, window, geo_column)
+    assert geo_flag == expected[geo_column.lower()].tolist()
+    np.testing.assert_allclose(changes, expected[rate_columns].to_numpy())
+
+
+@pytest.mark.parametrize('geo_column', levels)
+def testRunQueries(calls, cube, geo_column):
+    geo_flag = geo_columns[geo_column]
+    queries = queryGrid([event_date for event_date, window in events], geo_flag, sorted({window for event_date, window in events}))
+    results = runQueries(queries, cube, geo_flag = geo_flag, geo_column = geo_column)
+    assert len(results) == len(queries)
+    for (event_date, window), group in results.groupby(["event_date", "window"]):
+        expected = referencePercentages(calls, event_date, window, geo_column)
+        assert group["event_location"].tolist() == geo_flag
+        for name in rate_columns:
+            np.testing.assert_allclose(group[name].to_numpy(), expected[name].to_numpy())
+            # Population standard deviation across locations, and each location's z-score against it
+            spread = expected[name].std(ddof = 0)
+            np.testing.assert_allclose(group[name + "_std"].to_numpy(), spread)
+            if spread > 0:
+                np.testing.assert_allclose(group[name + "_z"].to_numpy(), (expected[name] - expected[name].mean()) / spread)
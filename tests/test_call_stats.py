@@ -0,0 +1,102 @@
+# Placebo dates, placebo locations and bootstrap intervals for one event, off a cube of synthetic calls
+
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from event_impact.call_cube import buildCube, windowCounts
+from event_impact.call_rates import percentChange
+from event_impact.call_stats import eventSignificance, placeboDates
+from event_impact.call_store import prepareCalls
+from event_impact.locations import beat, rate_columns
+from event_impact.synthetic import syntheticChunks
+
+event_date = pd.Timestamp('2015-09-15')
+window = 30
+
+
+@pytest.fixture(scope = 'module')
+def calls():
+    export = pd.concat(syntheticChunks(40000, start = '2015-01-01', end = '2016-06-30', seed = 7), ignore_index = True)
+    return prepareCalls(export)
+
+
+@pytest.fixture(scope = 'module')
+def cube(calls):
+    return buildCube(calls)
+
+
+@pytest.fixture(scope = 'module')
+def boosted_cube(calls):
+    # Five times as many calls in B2 for the window after event_date
+    after = calls.loc[(calls["Beat"] == "B2") & (calls["Date Queued"] >= event_date)
+                      & (calls["Date Queued"] < event_date + pd.Timedelta(days = window))]
+    return buildCube(pd.concat([calls] + [after] * 4, ignore_index = True))
+
+
+@pytest.mark.parametrize('date, days', [('2016-06-25', 30), ('2015-01-10', 30), ('2014-06-01', 30), ('2017-01-01', 30)])
+def testWindowsPastTheCubeAreRejected(cube, date, days):
+    with pytest.raises(ValueError, match = 'runs past the call data'):
+        eventSignificance(cube, datetime.date.fromisoformat(date), 'B2', days, count = 100, seed = 0)
+
+
+def testWindowsThatJustFit(cube):
+    days = cube.cumulative.shape[0] - 1
+    for event_index in [window - 1, days - window]:
+        significance = eventSignificance(cube, cube.first_day + pd.Timedelta(days = event_index), 'B2', window, count = 100, seed = 0)
+        assert significance.placebo_dates > 0
+
+
+def testShortWindowsAreRejected(cube):
+    with pytest.raises(ValueError, match = 'at least 2 days'):
+        eventSignificance(cube, event_date, 'B2', 1)
+
+
+def testSeededResultsRepeat(cube):
+    first = eventSignificance(cube, event_date, 'B2', window, count = 2000, seed = 1)
+    second = eventSignificance(cube, event_date, 'B2', window, count = 2000, seed = 1)
+    pd.testing.assert_frame_equal(first.table, second.table)
+    assert first.placebo_dates == second.placebo_dates
+
+
+def testNoEvent(cube):
+    table = eventSignificance(cube, event_date, 'B2', window, count = 2000, seed = 1).table
+    assert table.index.tolist() == rate_columns
+    # The change is the same one the percentages table gives
+    expected = percentChange(windowCounts(cube, event_date, window)).set_index("beat").loc["B2", rate_columns]
+    np.testing.assert_allclose(table["change"].to_numpy(), expected.to_numpy())
+    for column in ["p_placebo_dates", "p_placebo_locations"]:
+        assert ((table[column] > 0) & (table[column] <= 1)).all()
+    assert (table["p_placebo_locations"] >= 1 / len(beat)).all()
+    assert (table["change_low"] <= table["change_high"]).all()
+    assert (table["effect_low"] <= table["effect_high"]).all()
+    # Nothing happened in B2, so the total shouldn't come out as significant
+    assert table.loc["total", "p_placebo_dates"] > 0.05
+
+
+def testBoostedEvent(boosted_cube):
+    table = eventSignificance(boosted_cube, event_date, 'B2', window, count = 2000, seed = 1).table
+    total = table.loc["total"]
+    assert total["change"] > 300
+    assert total["p_placebo_locations"] == 1 / len(beat)
+    assert total["p_placebo_dates"] < 0.01
+    assert total["change_low"] > 100
+    assert total["effect_low"] > 100
+
+
+def testPlaceboDatesAreDistinct(cube):
+    days = cube.cumulative.shape[0] - 1
+    event_index = (event_date - cube.first_day).days
+    candidates = [day for day in range(window - 1, days - window + 1) if abs(day - event_index) >= 2 * window]
+
+    some = placeboDates(cube, event_index, window, 50, np.random.default_rng(0))
+    assert len(some) == 50
+    assert len(set(some.tolist())) == 50
+    assert set(some.tolist()) <= set(candidates)
+
+    # Asking for more than there are uses every candidate once
+    every = placeboDates(cube, event_index, window, 10000, np.random.default_rng(0))
+    assert sorted(every.tolist()) == candidates
+    assert eventSignificance(cube, event_date, 'B2', window, count = 10000, seed = 0).placebo_dates == len(candidates)
@@ -0,0 +1,69 @@
+# Streaming ingest and the nightly update, on a small synthetic export
+
+import numpy as np
+import pandas as pd
+
+from event_impact.call_cube import buildStoredCube, loadCube, saveCube, updateCube
+from event_impact.call_store import ingestExport, ingestNewCalls, loadCalls
+from event_impact.synthetic import syntheticChunks
+
+
+def syntheticExport(rows = 20000):
+    return pd.concat(syntheticChunks(rows, start = '2015-01-01', end = '2015-03-31', seed = 3), ignore_index = True)
+
+
+def assertSameCube(cube, expected):
+    assert cube.first_day == expected.first_day
+    assert cube.sources == expected.sources
+    pd.testing.assert_frame_equal(cube.locations, expected.locations)
+    np.testing.assert_array_equal(cube.cumulative, expected.cumulative)
+
+
+def testReplayingAPartlyDownloadedDay(tmp_path):
+    export = syntheticExport()
+    # The first download stopped partway through a day; the next export has the whole history again
+    queued = pd.to_datetime(export["Original Time Queued"], format = '%m/%d/%Y %I:%M:%S %p')
+    cutoff = int(np.searchsorted(queued.to_numpy(), np.datetime64('2015-02-10T13:00:00')))
+    export.iloc[:cutoff].to_csv(tmp_path / 'first.csv', index = False)
+    export.to_csv(tmp_path / 'full.csv', index = False)
+
+    store, cube_dir = str(tmp_path / 'store'), str(tmp_path / 'cube')
+    # A tiny budget, so the export is read in many chunks
+    ingestExport(tmp_path / 'first.csv', store, budget = 1)
+    saveCube(buildStoredCube(store), cube_dir)
+    new_calls = ingestNewCalls(tmp_path / 'full.csv', store, budget = 1)
+    updateCube(new_calls, cube_dir)
+
+    stored = loadCalls(store, columns = ["CAD Event Number"])["CAD Event Number"]
+    assert not stored.duplicated().any()
+    assert sorted(stored) == sorted(export["CAD Event Number"])
+    assert len(new_calls) == len(export) - cutoff
+
+    full_store, full_cube = str(tmp_path / 'full_store'), str(tmp_path / 'full_cube')
+    ingestExport(tmp_path / 'full.csv', full_store)
+    saveCube(buildStoredCube(full_store), full_cube)
+    assertSameCube(loadCube(cube_dir), loadCube(full_cube))
+
+
+def testNothingNew(tmp_path):
+    syntheticExport(2000).to_csv(tmp_path / 'export.csv', index = False)
+    store = str(tmp_path / 'store')
+    ingestExport(tmp_path / 'export.csv', store)
+    new_calls = ingestNewCalls(tmp_path / 'export.csv', store)
+    assert len(new_calls) == 0
+    assert len(loadCalls(store, columns = ["CAD Event Number"])) == 2000
+
+
+def testOddlyFormattedNewCalls(tmp_path):
+    export = syntheticExport(2000)
+    store = str(tmp_path / 'store')
+    export.to_csv(tmp_path / 'export.csv', index = False)
+    ingestExport(tmp_path / 'export.csv', store)
+    # Times the date part alone can't place, before and after the newest stored day
+    extra = export.iloc[:2].copy()
+    extra["CAD Event Number"] = [1, 2]
+    extra["Original Time Queued"] = ["1/5/2015 1:30:00 PM", "4/2/2015 1:30:00 PM"]
+    pd.concat([export, extra]).to_csv(tmp_path / 'export.csv', index = False)
+    new_calls = ingestNewCalls(tmp_path / 'export.csv', store)
+    assert new_calls["CAD Event Number"].tolist() == [2]
+    assert new_calls["Original Time Queued"].tolist() == [pd.Timestamp("2015-04-02 13:30:00")]
@@ -0,0 +1,65 @@
+# parseTimestamps against the SPD export's MM/DD/YYYY HH:MM:SS AM/PM strings and the ways they go wrong
+
+import numpy as np
+import pandas as pd
+
+from event_impact.call_times import parseDays, parseTimestamps
+
+
+def testTwelveHourClock():
+    parsed = parseTimestamps(["04/05/2015 12:00:00 AM", "04/05/2015 12:00:00 PM", "04/05/2015 01:30:00 PM",
+                              "04/05/2015 11:59:59 PM"])
+    assert parsed.timestamps.tolist() == [pd.Timestamp("2015-04-05 00:00:00"), pd.Timestamp("2015-04-05 12:00:00"),
+                                          pd.Timestamp("2015-04-05 13:30:00"), pd.Timestamp("2015-04-05 23:59:59")]
+    assert parsed.failed_count == 0
+
+
+def testDaysThatDontExist():
+    parsed = parseTimestamps(["02/30/2015 01:00:00 AM", "02/29/2016 01:00:00 AM", "02/29/2015 01:00:00 AM"])
+    assert pd.isna(parsed.timestamps[0])
+    assert parsed.timestamps[1] == pd.Timestamp("2016-02-29 01:00:00")
+    assert pd.isna(parsed.timestamps[2])
+    assert parsed.failed_count == 2
+
+
+def testUnpaddedAndOtherFormats():
+    # Strings that don't fit the fixed width go through the slower parsers
+    parsed = parseTimestamps(["4/5/2015 1:30:00 PM", "04/05/2015 1:30:00 AM", "2015-04-05 13:30:00"])
+    assert parsed.timestamps.tolist() == [pd.Timestamp("2015-04-05 13:30:00"), pd.Timestamp("2015-04-05 01:30:00"),
+                                          pd.Timestamp("2015-04-05 13:30:00")]
+    assert parsed.failed_count == 0
+
+
+def testRepeatedStrings():
+    values = ["04/05/2015 01:30:00 PM", "4/5/2015 1:30:00 PM", "04/06/2015 09:00:00 AM"] * 50
+    parsed = parseTimestamps(values)
+    assert parsed.timestamps.tolist() == [pd.Timestamp("2015-04-05 13:30:00"), pd.Timestamp("2015-04-05 13:30:00"),
+                                          pd.Timestamp("2015-04-06 09:00:00")] * 50
+
+
+def testFailuresAreCountedButMissingValuesAreNot():
+    values = pd.Series(["04/05/2015 01:30:00 PM", None, "not a time", np.nan, "02/30/2015 01:00:00 AM", "not a time"],
+                       index = [10, 11, 12, 13, 14, 15])
+    parsed = parseTimestamps(values, sample_size = 2)
+    assert parsed.timestamps.index.tolist() == values.index.tolist()
+    assert parsed.timestamps.isna().tolist() == [False, True, True, True, True, True]
+    assert parsed.failed_count == 3
+    assert parsed.failed_sample.index.tolist() == [12, 14]
+    assert parsed.failed_sample.tolist() == ["not a time", "02/30/2015 01:00:00 AM"]
+
+
+def testNothingToParse():
+    parsed = parseTimestamps(pd.Series([None, None], dtype = object))
+    assert parsed.timestamps.isna().all()
+    assert parsed.failed_count == 0
+    assert parsed.failed_sample.empty
+
+
+def testParseDays():
+    values = pd.Series(["04/05/2015 01:30:00 PM", "04/05/2015 11:00:00 AM", "4/5/2015 1:30:00 PM", None, "02/30/2015 01:00:00 AM"],
+                       index = [5, 6, 7, 8, 9])
+    days = parseDays(values)
+    assert days.index.tolist() == values.index.tolist()
+    assert days[5] == days[6] == pd.Timestamp("2015-04-05")
+    # Anything whose first ten characters aren't a date is left for the full parse
+    assert days[[7, 8, 9]].isna().all()
@@ -0,0 +1,137 @@
+# The query service end to end over a socket, on a small saved cube
+
+import asyncio
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from event_impact.call_cube import buildCube, saveCube, windowCounts
+from event_impact.call_rates import percentChange
+from event_impact.call_store import prepareCalls
+from event_impact.event_batch import runQueries
+from event_impact.locations import geo_columns, rate_columns
+from event_impact.service import ResultCache, startService
+from event_impact.synthetic import syntheticChunks
+
+
+@pytest.fixture(scope = 'module')
+def calls():
+    export = pd.concat(syntheticChunks(8000, start = '2015-01-01', end = '2015-06-30', seed = 11), ignore_index = True)
+    return prepareCalls(export)
+
+
+@pytest.fixture
+def cube_dir(calls, tmp_path):
+    saveCube(buildCube(calls), str(tmp_path / 'cube'))
+    return str(tmp_path / 'cube')
+
+
+async def request(reader, writer, target):
+    # One GET on a kept-alive connection; (status, parsed JSON body)
+    writer.write(('GET ' + target + ' HTTP/1.1\r\nHost: localhost\r\n\r\n').encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1')
+        if line in ('\r\n', ''):
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers['content-length']))
+    return status, json.loads(body)
+
+
+def runService(path, session):
+    # Starting the service on a free port, running session(get, service) against it, and shutting it down
+    async def run():
+        server, service = await startService(path, port = 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            return await session(lambda target: request(reader, writer, target), service)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+            server.close()
+            await server.wait_closed()
+            # Letting the connection handler see the client has gone before the loop shuts down
+            await asyncio.sleep(0.01)
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('level, location', [("Beat", "B2"), ("Sector", "K"), ("Precinct", "NORTH")])
+def testImpactMatchesTheCube(calls, cube_dir, level, location):
+    async def session(get, service):
+        return await get('/impact?date=2015-04-05&location=' + location + '&window=30&level=' + level.lower())
+
+    status, answer = runService(cube_dir, session)
+    assert status == 200
+    geo_flag = geo_columns[level]
+    cube = buildCube(calls)
+    expected = percentChange(windowCounts(cube, pd.Timestamp('2015-04-05'), 30, geo_flag, level))
+    percentages = pd.DataFrame(answer["percentages"])
+    assert percentages[level.lower()].tolist() == geo_flag
+    np.testing.assert_allclose(percentages[rate_columns].to_numpy(dtype = float), expected[rate_columns].to_numpy(), atol = 1e-4)
+
+    query = pd.DataFrame({"event_date": [pd.Timestamp('2015-04-05')], "event_location": [location], "window": [30]})
+    batch = runQueries(query, cube, geo_flag = geo_flag, geo_column = level).iloc[0]
+    for name in rate_columns:
+        assert answer["change"][name] == pytest.approx(batch[name], abs = 1e-4)
+        assert answer["std"][name] == pytest.approx(batch[name + "_std"], abs = 1e-4)
+        assert answer["z"][name] == pytest.approx(batch[name + "_z"], abs = 1e-4)
+
+
+def testBadQueries(cube_dir):
+    targets = ['/impact?date=2015-13-01&location=B2', '/impact?location=B2', '/impact?date=2015-04-05&location=ZZ',
+               '/impact?date=2015-04-05&location=B2&level=block', '/impact?date=2015-04-05&location=B2&window=1',
+               '/impact?date=2015-04-05&location=B2&window=ninety', '/impact?date=2030-01-01&location=B2',
+               '/impact?date=2015-04-05&location=K&level=sector&map=1']
+
+    async def session(get, service):
+        return [await get(target) for target in targets]
+
+    for target, (status, body) in zip(targets, runService(cube_dir, session)):
+        assert status == 400, target
+        assert body["error"]
+
+
+def testRewritingTheCubeClearsTheCache(calls, cube_dir):
+    async def session(get, service):
+        first = await get('/impact?date=2015-04-05&location=B2')
+        again = await get('/impact?date=2015-04-05&location=B2')
+        cached = (await get('/cache'))[1]
+        # The nightly update rewrites the cube with more calls
+        more = calls.loc[(calls["Beat"] == "B2") & (calls["Date Queued"] >= pd.Timestamp('2015-04-05'))]
+        saveCube(buildCube(pd.concat([calls, more])), cube_dir)
+        rewritten = await get('/impact?date=2015-04-05&location=B2')
+        return first, again, cached, rewritten, (await get('/cache'))[1]
+
+    first, again, cached, rewritten, after = runService(cube_dir, session)
+    assert first == again
+    assert cached["entries"] == 1 and cached["hits"] == 1
+    assert rewritten[0] == 200
+    assert rewritten[1]["percentages"] != first[1]["percentages"]
+    # Only the answer computed after the rewrite is cached
+    assert after["entries"] == 1
+
+
+def testResultCacheEvictsByBytes():
+    cache = ResultCache(max_bytes = 10)
+    cache.put("a", b'1234')
+    cache.put("b", b'1234')
+    assert cache.get("a") == b'1234'
+    # "b" is now the least recently used, and goes first
+    cache.put("c", b'1234')
+    assert cache.get("b") is None
+    assert cache.get("a") == b'1234' and cache.get("c") == b'1234'
+    assert cache.size == 8
+    # Too big to cache at all
+    cache.put("d", b'12345678901')
+    assert cache.get("d") is None
+    assert cache.stats() == {"entries": 2, "bytes": 8, "max_bytes": 10, "hits": 3, "misses": 2}
+    cache.put("a", b'123456')
+    assert cache.size == 10 and list(cache.entries) == ["c", "a"]